@@ -0,0 +1,405 @@
+"""
+A local stand-in for the parts of the GitHub REST and GraphQL apis used by the plugin.
+
+The shape of a repository is encoded in its name, e.g. `wf8-jobs12-st3-apps2-fail1` has
+8 workflow runs of 12 jobs each, the first of which failed, 3 commit statuses and 2
+check runs posted by other apps.  Every repository has a single commit on every branch.
+
+Responses carry ETags and answer conditional requests with 304, list endpoints are
+paginated with Link headers, bodies are gzipped when the client accepts it, and every
+response has rate limit headers.  `GET /_stats`
+returns the request counters, `POST /_reset` clears them.  Job logs redirect to a
+download url that answers Range requests.
+
+    python mock_github.py [--port PORT] [--latency SECONDS]
+
+The port is printed on the first line of stdout.
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, urlencode
+
+
+TIMESTAMP = "2020-01-01T00:00:00Z"
+FINISHED = "2020-01-01T00:05:00Z"
+
+
+def repo_shape(name):
+    shape = {"wf": 1, "jobs": 1, "st": 0, "apps": 0, "fail": 0}
+    for key, value in re.findall(r"([a-z]+)(\d+)", name):
+        shape[key] = int(value)
+    return shape
+
+
+def commit_sha(owner, repo, branch):
+    return hashlib.sha1("/".join((owner, repo, branch)).encode("utf-8")).hexdigest()
+
+
+def padding(n):
+    # stand-in for the many fields of the real payloads that the plugin ignores
+    return {"field_{:d}".format(i): "https://api.github.com/some/url/{:d}".format(i)
+            for i in range(n)}
+
+
+def workflow_runs(owner, repo, sha):
+    shape = repo_shape(repo)
+    runs = []
+    for i in range(shape["wf"]):
+        runs.append({
+            "id": 1000 + i,
+            "name": "Workflow {:d}".format(i),
+            "head_sha": sha,
+            "event": "push",
+            "status": "completed",
+            "conclusion": "success",
+            "check_suite_id": 5000 + i,
+            "created_at": TIMESTAMP,
+            "updated_at": FINISHED,
+            "head_commit": {"id": sha, "message": "commit message\n" * 5},
+            "repository": dict(padding(40), full_name=owner + "/" + repo),
+            "head_repository": dict(padding(40), full_name=owner + "/" + repo),
+        })
+    return runs
+
+
+def jobs(owner, repo, run_id):
+    shape = repo_shape(repo)
+    return [{
+        "id": run_id * 1000 + j,
+        "run_id": run_id,
+        "name": "job {:d}".format(j),
+        "status": "completed",
+        "conclusion": "failure" if j < shape["fail"] else "success",
+        "html_url": "https://github.com/{}/{}/runs/{:d}".format(owner, repo, run_id * 1000 + j),
+        "started_at": TIMESTAMP,
+        "completed_at": FINISHED,
+        "steps": [{"name": "step {:d}".format(k), "status": "completed",
+                   "conclusion": "success", "number": k} for k in range(8)]
+    } for j in range(shape["jobs"])]
+
+
+def statuses(owner, repo):
+    shape = repo_shape(repo)
+    return [{
+        "context": "status {:d}".format(i),
+        "state": "success",
+        "description": "all good",
+        "target_url": "https://ci.example.com/{:d}".format(i),
+        "created_at": TIMESTAMP,
+        "updated_at": FINISHED
+    } for i in range(shape["st"])]
+
+
+def check_runs(owner, repo, sha):
+    runs = []
+    for run in workflow_runs(owner, repo, sha):
+        for job in jobs(owner, repo, run["id"]):
+            runs.append({
+                "id": job["id"],
+                "name": job["name"],
+                "status": job["status"],
+                "conclusion": job["conclusion"],
+                "html_url": job["html_url"],
+                "details_url": job["html_url"],
+                "started_at": job["started_at"],
+                "completed_at": job["completed_at"],
+                "output": {"title": None, "summary": None},
+                "check_suite": {"id": run["check_suite_id"]},
+                "app": {"slug": "github-actions", "name": "GitHub Actions"}
+            })
+    for i in range(repo_shape(repo)["apps"]):
+        runs.append({
+            "id": 9000 + i,
+            "name": "app check {:d}".format(i),
+            "status": "completed",
+            "conclusion": "success",
+            "html_url": "https://github.com/{}/{}/runs/{:d}".format(owner, repo, 9000 + i),
+            "details_url": "https://app.example.com/{:d}".format(i),
+            "started_at": TIMESTAMP,
+            "completed_at": FINISHED,
+            "output": {"title": "passed", "summary": "passed"},
+            "check_suite": {"id": 8000 + i},
+            "app": {"slug": "app-{:d}".format(i), "name": "App {:d}".format(i)}
+        })
+    return runs
+
+
+def check_suites(owner, repo, sha):
+    suites = [{
+        "id": run["check_suite_id"],
+        "status": "completed",
+        "conclusion": "success",
+        "latest_check_runs_count": repo_shape(repo)["jobs"],
+        "created_at": TIMESTAMP,
+        "updated_at": FINISHED,
+        "app": {"slug": "github-actions", "name": "GitHub Actions"}
+    } for run in workflow_runs(owner, repo, sha)]
+    suites.extend({
+        "id": 8000 + i,
+        "status": "completed",
+        "conclusion": "success",
+        "latest_check_runs_count": 1,
+        "created_at": TIMESTAMP,
+        "updated_at": FINISHED,
+        "app": {"slug": "app-{:d}".format(i), "name": "App {:d}".format(i)}
+    } for i in range(repo_shape(repo)["apps"]))
+    return suites
+
+
+def rollup_contexts(owner, repo, sha):
+    contexts = []
+    runs = {run["check_suite_id"]: run for run in workflow_runs(owner, repo, sha)}
+    for check_run in check_runs(owner, repo, sha):
+        run = runs.get(check_run["check_suite"]["id"])
+        contexts.append({
+            "__typename": "CheckRun",
+            "databaseId": check_run["id"],
+            "name": check_run["name"],
+            "status": check_run["status"].upper(),
+            "conclusion": check_run["conclusion"].upper(),
+            "detailsUrl": check_run["details_url"],
+            "startedAt": check_run["started_at"],
+            "completedAt": check_run["completed_at"],
+            "checkSuite": {
+                "createdAt": TIMESTAMP,
+                "workflowRun": {
+                    "event": "push",
+                    "workflow": {"name": run["name"]}
+                } if run else None
+            }
+        })
+    for status in statuses(owner, repo):
+        contexts.append({
+            "__typename": "StatusContext",
+            "context": status["context"],
+            "state": status["state"].upper(),
+            "description": status["description"],
+            "targetUrl": status["target_url"],
+            "createdAt": status["created_at"]
+        })
+    return contexts
+
+
+def job_log(job_id, lines=20000):
+    log = ["2020-01-01T00:00:{:02d}.0000000Z line {:d} of job {:d}".format(i % 60, i, job_id)
+           for i in range(lines)]
+    log.append("2020-01-01T00:04:59.0000000Z ##[error]Process completed with exit code 1.")
+    return ("\n".join(log) + "\n").encode("utf-8")
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.requests = 0
+        self.not_modified = 0
+        self.bytes = 0
+        self.rate_limit_used = 0
+
+    def as_dict(self):
+        return {
+            "requests": self.requests,
+            "not_modified": self.not_modified,
+            "bytes": self.bytes,
+            "rate_limit_used": self.rate_limit_used
+        }
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    latency = 0
+    per_page_default = 30
+    stats = Stats()
+
+    def log_message(self, format, *args):
+        pass
+
+    counted = False
+
+    def end_headers(self):
+        if self.counted:
+            with self.stats.lock:
+                self.stats.bytes += sum(len(h) for h in self._headers_buffer)
+        super().end_headers()
+
+    def send_json(self, payload, link=None):
+        body = json.dumps(payload).encode("utf-8")
+        etag = '"{}"'.format(hashlib.sha1(body).hexdigest())
+        not_modified = self.headers.get("If-None-Match") == etag
+
+        self.counted = True
+        with self.stats.lock:
+            self.stats.requests += 1
+            if not_modified:
+                self.stats.not_modified += 1
+            else:
+                self.stats.rate_limit_used += 1
+            remaining = max(0, 5000 - self.stats.rate_limit_used)
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        self.send_response(304 if not_modified else 200)
+        self.send_header("ETag", etag)
+        self.send_header("X-RateLimit-Limit", "5000")
+        self.send_header("X-RateLimit-Remaining", str(remaining))
+        self.send_header("X-RateLimit-Reset", str(int(time.time()) + 3600))
+        if link:
+            self.send_header("Link", link)
+        if not_modified:
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        with self.stats.lock:
+            self.stats.bytes += len(body)
+
+    def send_page(self, url, query, key, items, extra=None):
+        per_page = min(int(query.get("per_page", [self.per_page_default])[0]), 100)
+        page = int(query.get("page", ["1"])[0])
+        payload = dict(extra or {}, total_count=len(items))
+        payload[key] = items[(page - 1) * per_page:page * per_page]
+        link = None
+        if page * per_page < len(items):
+            next_query = {k: v[0] for k, v in query.items()}
+            next_query["page"] = page + 1
+            link = '<http://{}{}?{}>; rel="next"'.format(
+                self.headers.get("Host"), url.path, urlencode(next_query))
+        self.send_json(payload, link)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        parts = url.path.strip("/").split("/")
+
+        if parts == ["_stats"]:
+            return self.send_raw(self.stats.as_dict())
+
+        if parts[0] == "_blobs":
+            if "sig" not in query:
+                return self.send_error(403)
+            return self.send_ranged(job_log(int(parts[2])))
+
+        if len(parts) < 4 or parts[0] != "repos":
+            return self.send_error(404)
+        owner, repo, rest = parts[1], parts[2], parts[3:]
+
+        if rest[0] == "branches":
+            return self.send_json({"commit": {"sha": commit_sha(owner, repo, rest[1])}})
+
+        if rest[:2] == ["actions", "runs"] and len(rest) == 2:
+            branch = query.get("branch", ["master"])[0]
+            sha = commit_sha(owner, repo, branch)
+            runs = workflow_runs(owner, repo, sha)
+            if "head_sha" in query:
+                runs = [run for run in runs if run["head_sha"] == query["head_sha"][0]]
+            return self.send_page(url, query, "workflow_runs", runs)
+
+        if rest[:2] == ["actions", "runs"] and rest[3:] == ["jobs"]:
+            return self.send_page(url, query, "jobs", jobs(owner, repo, int(rest[2])))
+
+        if rest[0] == "commits" and rest[2:] == ["status"]:
+            return self.send_json({"state": "success", "statuses": statuses(owner, repo)})
+
+        if rest[0] == "commits" and rest[2:] == ["check-runs"]:
+            return self.send_page(url, query, "check_runs", check_runs(owner, repo, rest[1]))
+
+        if rest[0] == "commits" and rest[2:] == ["check-suites"]:
+            return self.send_page(url, query, "check_suites", check_suites(owner, repo, rest[1]))
+
+        if rest[0] == "check-suites" and rest[2:] == ["check-runs"]:
+            runs = [run for run in check_runs(owner, repo, commit_sha(owner, repo, "master"))
+                    if run["check_suite"]["id"] == int(rest[1])]
+            return self.send_page(url, query, "check_runs", runs)
+
+        if rest[:2] == ["actions", "jobs"] and rest[3:] == ["logs"]:
+            self.send_response(302)
+            self.send_header("Location", "http://{}/_blobs/jobs/{}/logs?sig=bench".format(
+                self.headers.get("Host"), rest[2]))
+            self.send_header("Content-Length", "0")
+            return self.end_headers()
+
+        self.send_error(404)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+
+        if url.path == "/_reset":
+            self.stats.reset()
+            return self.send_raw({})
+
+        if url.path.endswith("/graphql"):
+            variables = json.loads(body.decode("utf-8"))["variables"]
+            owner, repo = variables["owner"], variables["repo"]
+            branch = variables["ref"][len("refs/heads/"):]
+            sha = commit_sha(owner, repo, branch)
+            contexts = rollup_contexts(owner, repo, sha)
+            start = int(variables.get("cursor") or 0)
+            nodes = contexts[start:start + 100]
+            end = start + len(nodes)
+            return self.send_json({"data": {"repository": {"ref": {"target": {
+                "oid": sha,
+                "statusCheckRollup": {"contexts": {
+                    "pageInfo": {"hasNextPage": end < len(contexts), "endCursor": str(end)},
+                    "nodes": nodes
+                }}
+            }}}}})
+
+        self.send_error(404)
+
+    def send_ranged(self, body):
+        match = re.match(r"bytes=-(\d+)$", self.headers.get("Range", ""))
+        if match:
+            start = max(0, len(body) - int(match.group(1)))
+            self.send_response(206)
+            self.send_header("Content-Range", "bytes {:d}-{:d}/{:d}".format(
+                start, len(body) - 1, len(body)))
+            body = body[start:]
+        else:
+            self.send_response(200)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_raw(self, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0,
+                        help="seconds to wait before each response")
+    args = parser.parse_args()
+
+    Handler.latency = args.latency
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), Handler)
+    print(server.server_address[1], flush=True)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+POST recorded webhook deliveries to the listener of the plugin, in file name order.
+The event of a payload is named by its file name, e.g. `2-status.json` is a `status`
+delivery.
+
+    python bench/replay_webhooks.py [--url URL] [--secret SECRET] [PAYLOAD ...]
+
+With `--url`, the payloads are sent to a running listener, e.g. the one of Sublime Text
+with "webhook_port" set.  Without it, the plugin is imported with the stub `sublime`
+modules, the checks of `bench/wf2-jobs3-st1` are fetched from `mock_github.py`, and the
+payloads in `webhooks/` are sent to a listener on a free port; after every delivery the
+checks it names must have been updated in place.
+"""
+
+import argparse
+import glob
+import hashlib
+import hmac
+import json
+import os
+import re
+import sys
+import time
+import urllib.error
+import urllib.request
+
+from run_benchmarks import HERE, load_plugin, start_server
+
+
+REPO = "wf2-jobs3-st1"
+
+
+def event_name(path):
+    return re.sub(r"^\d+-", "", os.path.splitext(os.path.basename(path))[0])
+
+
+def post(url, path, secret=None):
+    with open(path, "rb") as f:
+        body = f.read()
+    headers = {"Content-Type": "application/json", "X-GitHub-Event": event_name(path)}
+    if secret:
+        digest = hmac.new(secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+        headers["X-Hub-Signature-256"] = "sha256=" + digest
+    request = urllib.request.Request(url, data=body, headers=headers)
+    try:
+        with urllib.request.urlopen(request) as f:
+            return f.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def replay(plugin, server_url, payloads):
+    from GitHubChecks.query import github
+    from GitHubChecks.query.webhooks import parse_event
+    from GitHubChecks.utils.checks import Check
+    import sublime
+
+    github.api_urls["github.com"] = server_url
+    sublime._settings["github_checks.sublime-settings"] = {
+        "token": {"github.com": "bench"}, "webhook_port": 0}
+    plugin.start_webhook_receiver()
+    url = "http://127.0.0.1:{:d}/".format(plugin._webhook_receiver.port)
+
+    key = plugin.RepoKey("github.com", "bench", REPO, "master")
+    fetcher = plugin.RepoFetcher.get(key, "https://github.com/bench/{}.git".format(REPO))
+    fetcher.run_async(force=True)
+    print("fetched {:d} checks of {}".format(len(plugin.builds[key].checks), REPO))
+
+    def checks():
+        return plugin.builds[key].checks
+
+    failures = []
+    for path in payloads:
+        with open(path, encoding="utf-8") as f:
+            update = parse_event(event_name(path), json.load(f))
+        status = post(url, path)
+        ok = status == 202 and wait_for(lambda: all(
+            checks().get(context) == Check.from_dict(check)
+            for context, check in update.checks.items()
+        ) and not any(context in checks() for context in update.removed))
+        print("{:<24} {:d} {}".format(os.path.basename(path), status, "ok" if ok else "FAILED"))
+        for context in sorted(set(update.checks) | set(update.removed)):
+            check = checks().get(context)
+            print("    {} - {}".format(context, check.state if check else "removed"))
+        if not ok:
+            failures.append(path)
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--url", help="the listener to send the payloads to")
+    parser.add_argument("--secret", help="sign the payloads with this webhook secret")
+    parser.add_argument("payloads", nargs="*", help="payload files")
+    args = parser.parse_args()
+
+    payloads = args.payloads or sorted(glob.glob(os.path.join(HERE, "webhooks", "*.json")))
+
+    if args.url:
+        for path in payloads:
+            print("{:<24} {:d}".format(os.path.basename(path), post(args.url, path, args.secret)))
+        return
+
+    plugin = load_plugin()
+    server, server_url = start_server(0)
+    try:
+        failures = replay(plugin, server_url, payloads)
+    finally:
+        server.terminate()
+        plugin.plugin_unloaded()
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""
+Measure what a refresh costs, without network access or Sublime Text.
+
+The plugin is imported with the stub `sublime` modules in `stubs/`, pointed at a local
+`mock_github.py` server, and its fetch logic is run for every combination of repository
+shape and backend settings below, once with empty caches ("cold") and once more right
+after ("warm", answered with 304s).  For each run it reports the number of requests, the
+bytes transferred, the wall-clock latency and the CPU time of the client.
+
+    python bench/run_benchmarks.py [--latency SECONDS] [--json FILE] [--baseline FILE]
+
+The run fails if the backends do not agree on the number of checks of a repository, or
+if any scenario finds a different number of checks, needs more requests or more than
+10% more bytes than recorded in the baseline (a previous `--json` output,
+`baseline.json` by default; pass `--baseline ""` to skip it).  After an intended change
+of the numbers, update the baseline with `--json bench/baseline.json`.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import types
+import urllib.request
+from collections import OrderedDict
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+PACKAGE = "GitHubChecks"
+
+REPOS = [
+    "wf2-jobs3-st1",
+    "wf8-jobs12-st3-apps2",
+    "wf12-jobs120-st3-apps5",
+]
+
+BACKENDS = [
+    ("rest", {"backend": "rest", "check_runs": "off"}),
+    ("rest+apps", {"backend": "rest", "check_runs": "apps"}),
+    ("check_runs", {"backend": "rest", "check_runs": "all"}),
+    ("graphql", {"backend": "graphql", "check_runs": "off"}),
+]
+# the backends which read the checks of every app, "rest" leaves out the check runs api
+COMPLETE_BACKENDS = ("rest+apps", "check_runs", "graphql")
+
+
+def load_plugin():
+    sys.path.insert(0, os.path.join(HERE, "stubs"))
+    package = types.ModuleType(PACKAGE)
+    package.__path__ = [ROOT]
+    sys.modules[PACKAGE] = package
+    __import__(PACKAGE + ".github_checks")
+    return sys.modules[PACKAGE + ".github_checks"]
+
+
+def start_server(latency):
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(HERE, "mock_github.py"), "--latency", str(latency)],
+        stdout=subprocess.PIPE)
+    port = int(server.stdout.readline())
+    return server, "http://127.0.0.1:{:d}".format(port)
+
+
+def server_call(url, path, post=False):
+    data = b"" if post else None
+    with urllib.request.urlopen(url + path, data=data) as f:
+        return json.loads(f.read().decode("utf-8"))
+
+
+def refresh(plugin, url, repo):
+    key = plugin.RepoKey("github.com", "bench", repo, "master")
+    fetcher = plugin.RepoFetcher(key, "https://github.com/bench/{}.git".format(repo))
+
+    server_call(url, "/_reset", post=True)
+    wall, cpu = time.perf_counter(), time.process_time()
+    fetcher.run_async(force=True)
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    stats = server_call(url, "/_stats")
+
+    build = plugin.builds.get(key)
+    return {
+        "checks": len(build.checks) if build else 0,
+        "requests": stats["requests"],
+        "not_modified": stats["not_modified"],
+        "bytes": stats["bytes"],
+        "wall_ms": round(wall * 1000, 1),
+        "cpu_ms": round(cpu * 1000, 1)
+    }
+
+
+def run(plugin, url):
+    from GitHubChecks.query import github, interwebs
+    import sublime
+
+    github.api_urls["github.com"] = url
+    results = {}
+    for repo in REPOS:
+        for backend, settings in BACKENDS:
+            values = {"token": {"github.com": "bench"}, "adaptive_refresh": False}
+            values.update(settings)
+            sublime._settings["github_checks.sublime-settings"] = values
+
+            github.cache.clear()
+            interwebs.pool.close_all()
+            plugin.builds.clear()
+            results["{} {} cold".format(repo, backend)] = refresh(plugin, url, repo)
+            results["{} {} warm".format(repo, backend)] = refresh(plugin, url, repo)
+    return results
+
+
+def report(results):
+    columns = ("checks", "requests", "not_modified", "bytes", "wall_ms", "cpu_ms")
+    width = max(len(name) for name in results)
+    print("{:<{}}  ".format("scenario", width) + "  ".join(
+        "{:>12}".format(c) for c in columns))
+    for name, result in results.items():
+        print("{:<{}}  ".format(name, width) + "  ".join(
+            "{:>12}".format(result[c]) for c in columns))
+
+
+def compare(results, baseline):
+    failures = []
+    for name, expected in baseline.items():
+        result = results.get(name)
+        if not result:
+            continue
+        if result["checks"] != expected["checks"]:
+            failures.append("{}: {} checks instead of {}".format(
+                name, result["checks"], expected["checks"]))
+        if result["requests"] > expected["requests"]:
+            failures.append("{}: {} requests instead of {}".format(
+                name, result["requests"], expected["requests"]))
+        if result["bytes"] > expected["bytes"] * 1.1:
+            failures.append("{}: {} bytes instead of {}".format(
+                name, result["bytes"], expected["bytes"]))
+    return failures
+
+
+def check_consistency(results):
+    """
+    Every complete backend, cold or warm, must find the same checks of a repository.
+    """
+    failures = []
+    for repo in REPOS:
+        counts = OrderedDict()
+        for name, result in results.items():
+            scenario_repo, backend, _ = name.split(" ")
+            if scenario_repo == repo and backend in COMPLETE_BACKENDS:
+                counts[name] = result["checks"]
+        if len(set(counts.values())) > 1:
+            failures.append("{}: backends disagree on the number of checks: {}".format(
+                repo, ", ".join("{} {}".format(
+                    name[len(repo) + 1:], n) for name, n in counts.items())))
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--latency", type=float, default=0.02,
+                        help="simulated server latency per request in seconds")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", default=os.path.join(HERE, "baseline.json"),
+                        help="fail on regressions against this file")
+    args = parser.parse_args()
+
+    plugin = load_plugin()
+    server, url = start_server(args.latency)
+    try:
+        results = run(plugin, url)
+    finally:
+        server.terminate()
+        plugin.plugin_unloaded()
+
+    report(results)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    failures = check_consistency(results)
+    if args.baseline:
+        with open(args.baseline) as f:
+            failures += compare(results, json.load(f))
+    for failure in failures:
+        print(failure, file=sys.stderr)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+A minimal stand-in for the `sublime` module, enough to import the plugin and run its
+fetch logic outside of Sublime Text.
+"""
+
+import tempfile
+import threading
+
+DRAW_NO_FILL = 32
+DRAW_NO_OUTLINE = 256
+DRAW_SOLID_UNDERLINE = 512
+HIDE_ON_MOUSE_MOVE_AWAY = 2
+HOVER_TEXT = 1
+LAYOUT_INLINE = 0
+
+_cache_path = tempfile.mkdtemp(prefix="github-checks-bench-")
+_settings = {}
+
+
+class Settings:
+    def __init__(self, name):
+        self.name = name
+
+    @property
+    def values(self):
+        # looked up on every access, so that `_settings` can be replaced as a whole
+        return _settings.setdefault(self.name, {})
+
+    def get(self, key, default=None):
+        return self.values.get(key, default)
+
+    def set(self, key, value):
+        self.values[key] = value
+
+    def add_on_change(self, tag, callback):
+        pass
+
+    def clear_on_change(self, tag):
+        pass
+
+
+class Region:
+    def __init__(self, a, b=None):
+        self.a = a
+        self.b = a if b is None else b
+
+
+def load_settings(name):
+    return Settings(name)
+
+
+def save_settings(name):
+    pass
+
+
+def platform():
+    return "linux"
+
+
+def cache_path():
+    return _cache_path
+
+
+def packages_path():
+    return _cache_path
+
+
+def windows():
+    return []
+
+
+def set_timeout(callback, delay=0):
+    threading.Timer(delay / 1000, callback).start()
+
+
+def set_timeout_async(callback, delay=0):
+    threading.Timer(delay / 1000, callback).start()
+
+
+def status_message(message):
+    pass
@@ -0,0 +1,197 @@
+"""
+Fetch the checks of many branches concurrently and print them as JSON, without Sublime
+Text.  Run it from the directory containing the package, e.g. `Packages`:
+
+    python -m GitHubChecks.core [--concurrency N] [--backend rest|graphql]
+        [--check-runs apps|all|off] [--token FQDN=TOKEN] [--api FQDN=URL] REPO ...
+
+A REPO is either the path of a local clone, standing for the branch tracked by its
+current branch, or `[fqdn/]owner/repo@branch`, e.g. `randy3k/GitHubChecks@master`.  The
+token of github.com defaults to $GITHUB_TOKEN.  `--api` points a host at another api
+url, e.g. `bench/mock_github.py`.
+
+The output lists, in the order of the REPOs, the sha of the head of each branch, the
+number of checks in each state and the checks; or the error if it could not be fetched.
+The exit status is 1 if any REPO failed.
+"""
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+
+from ..query import github
+from ..query.github import RepoContext, parse_remote_url
+from ..query.ratelimit import RateLimitExceeded
+from ..utils import gitrepo
+from ..utils.checks import State
+from ..utils.loop import EventLoop
+from .fetcher import ChecksFetcher, FetchFailed, RepoKey
+
+
+SPEC = re.compile(r"^(?:([^/@]+)/)?([^/@]+)/([^/@]+)@(.+)$")
+
+
+def git(path, *args):
+    """
+    The output of the git command `args` run in `path`, or None if it fails.
+    """
+    try:
+        output = subprocess.check_output(
+            ("git",) + args, cwd=path, stderr=subprocess.DEVNULL)
+    except subprocess.CalledProcessError:
+        return None
+    return output.decode("utf-8").strip() or None
+
+
+def head_branch(path):
+    try:
+        return gitrepo.head_branch(path)
+    except gitrepo.NotARepository:
+        raise
+    except (gitrepo.Unsupported, OSError):
+        return git(path, "symbolic-ref", "HEAD", "--short")
+
+
+def git_config(path, key):
+    try:
+        return gitrepo.config(path, key)
+    except gitrepo.NotARepository:
+        raise
+    except (gitrepo.Unsupported, OSError):
+        return git(path, "config", key)
+
+
+def resolve_path(path):
+    """
+    The (RepoKey, remote_url) of the branch tracked by the current branch of the clone
+    at `path`, read by git if gitrepo cannot, like the plugin does.  Raise ValueError if
+    there is none.
+    """
+    try:
+        branch = head_branch(path)
+        if not branch:
+            raise ValueError("HEAD is detached")
+        remote = git_config(path, "branch.{}.remote".format(branch))
+        if not remote:
+            raise ValueError("branch {} has no remote".format(branch))
+        remote_url = git_config(path, "remote.{}.url".format(remote))
+        tracking_branch = git_config(path, "branch.{}.merge".format(branch))
+    except (gitrepo.Unsupported, OSError) as e:
+        raise ValueError(str(e))
+    github_repo = parse_remote_url(remote_url or "")
+    if not github_repo:
+        raise ValueError("remote {} is not a GitHub repository".format(remote))
+    if not tracking_branch or not tracking_branch.startswith("refs/heads/"):
+        raise ValueError("branch {} does not track a branch".format(branch))
+    key = RepoKey(
+        github_repo.fqdn, github_repo.owner, github_repo.repo,
+        tracking_branch[len("refs/heads/"):])
+    return key, remote_url
+
+
+def resolve_spec(spec):
+    """
+    The (RepoKey, remote_url) of a REPO argument.  Raise ValueError if it is invalid.
+    """
+    if os.path.isdir(spec):
+        return resolve_path(spec)
+    match = SPEC.match(spec)
+    if not match:
+        raise ValueError("neither a directory nor owner/repo@branch")
+    fqdn, owner, repo, branch = match.groups()
+    key = RepoKey(fqdn or "github.com", owner, repo, branch)
+    return key, "https://{}/{}/{}".format(key.fqdn, key.owner, key.repo)
+
+
+def fetch(fetcher, spec, tokens, executor):
+    """
+    The result of a REPO.  Any error is reported in its "error" rather than raised, so
+    that it does not take the results of the other REPOs with it.
+    """
+    result = {"spec": spec}
+    try:
+        fetch_into(result, fetcher, spec, tokens, executor)
+    except (ValueError, RateLimitExceeded, FetchFailed) as e:
+        result["error"] = str(e)
+    except Exception as e:
+        result["error"] = "{}: {}".format(type(e).__name__, e)
+    return result
+
+
+def fetch_into(result, fetcher, spec, tokens, executor):
+    key, remote_url = resolve_spec(spec)
+    result.update(key._asdict())
+
+    repo_context = RepoContext.resolve(parse_remote_url(remote_url), tokens.get(key.fqdn))
+    fetched = fetcher.fetch(repo_context, key.branch, executor)
+    if fetched is None:
+        raise ValueError("cannot fetch the checks of the branch")
+
+    build, _ = fetched
+    result["sha"] = build.sha
+    result["counts"] = {state: build.counts.get(state, 0) for state in State.ALL}
+    result["checks"] = [check.as_dict() for _, check in sorted(build.checks.items())]
+
+
+def fetch_all(specs, settings, tokens, concurrency=4):
+    """
+    Fetch the REPOs `specs`, `concurrency` branches and requests at a time.
+    """
+    loop = EventLoop(workers=concurrency, io_workers=concurrency)
+    fetcher = ChecksFetcher(settings)
+    try:
+        futures = [
+            loop.run_in_worker(fetch, fetcher, spec, tokens, loop.io) for spec in specs]
+        return [future.result() for future in futures]
+    finally:
+        loop.close()
+
+
+def assignments(values):
+    result = {}
+    for value in values:
+        name, _, setting = value.partition("=")
+        result[name] = setting
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python -m GitHubChecks.core", description=__doc__.strip().splitlines()[0])
+    parser.add_argument("repos", nargs="+", metavar="REPO",
+                        help="path of a local clone, or [fqdn/]owner/repo@branch")
+    parser.add_argument("--concurrency", type=int, default=4,
+                        help="maximum number of branches fetched, and of requests, at once")
+    parser.add_argument("--backend", choices=("rest", "graphql"), default="rest")
+    parser.add_argument("--check-runs", choices=("apps", "all", "off"), default="apps")
+    parser.add_argument("--ignore", action="append", default=[], metavar="CONTEXT",
+                        help="ignore the checks named CONTEXT")
+    parser.add_argument("--token", action="append", default=[], metavar="FQDN=TOKEN",
+                        help="api token of a host")
+    parser.add_argument("--api", action="append", default=[], metavar="FQDN=URL",
+                        help="api url of a host")
+    args = parser.parse_args()
+
+    tokens = {}
+    if os.environ.get("GITHUB_TOKEN"):
+        tokens["github.com"] = os.environ["GITHUB_TOKEN"]
+    tokens.update(assignments(args.token))
+    github.api_urls.update(assignments(args.api))
+    settings = {
+        "backend": args.backend,
+        "check_runs": args.check_runs,
+        "ignore_services": args.ignore
+    }
+
+    results = fetch_all(args.repos, settings, tokens, max(1, args.concurrency))
+    json.dump(results, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write("\n")
+    if any("error" in result for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
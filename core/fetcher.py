@@ -0,0 +1,583 @@
+"""
+The fetch engine of the plugin, which does not depend on Sublime Text: the queries
+collecting the checks of the head of a branch through the REST or the GraphQL api.
+It is wrapped by the fetchers of the plugin and run by `python -m GitHubChecks.core`.
+"""
+
+from collections import namedtuple
+from urllib.parse import quote
+
+from ..query.github import (
+    check_state, check_time, query_github, query_github_paginated, query_graphql)
+from ..query.interwebs import REQUEST_ERRORS
+from ..query.webhooks import commit_checks_url
+from ..utils.checks import Build, State
+
+
+CHECK_ROLLUP_QUERY = """
+query($owner: String!, $repo: String!, $ref: String!, $cursor: String) {
+  repository(owner: $owner, name: $repo) {
+    ref(qualifiedName: $ref) {
+      target {
+        ... on Commit {
+          oid
+          statusCheckRollup {
+            contexts(first: 100, after: $cursor) {
+              pageInfo {
+                hasNextPage
+                endCursor
+              }
+              nodes {
+                __typename
+                ... on CheckRun {
+                  databaseId
+                  name
+                  status
+                  conclusion
+                  detailsUrl
+                  startedAt
+                  completedAt
+                  checkSuite {
+                    createdAt
+                    workflowRun {
+                      event
+                      workflow {
+                        name
+                      }
+                    }
+                  }
+                }
+                ... on StatusContext {
+                  context
+                  state
+                  description
+                  targetUrl
+                  createdAt
+                }
+              }
+            }
+          }
+        }
+      }
+    }
+  }
+}
+"""
+
+
+RepoKey = namedtuple("RepoKey", ("fqdn", "owner", "repo", "branch"))
+
+
+def count_states(builds):
+    """
+    The numbers of successful, failed, errored, skipped and pending checks of `builds`.
+    """
+    return tuple(
+        sum(build.counts.get(state, 0) for build in builds)
+        for state in (State.SUCCESS, State.FAILURE, State.ERROR, State.SKIPPED, State.PENDING))
+
+
+class Superseded(Exception):
+    pass
+
+
+class FetchFailed(Exception):
+    """
+    A request of a fetch failed, e.g. it timed out or the server errored, so that the
+    checks collected by the fetch are incomplete.
+    """
+    pass
+
+
+def check_response(response):
+    """
+    Raise FetchFailed if the server failed to answer `response`.  Other statuses, e.g.
+    a missing repository, are answered by an empty result.
+    """
+    if response.status >= 500:
+        raise FetchFailed("request status: {:d}".format(response.status))
+
+
+class ChecksFetcher:
+    """
+    Fetch the checks of the head of a branch.  `settings` is anything with a `get(key,
+    default)` method, e.g. the settings of the package or a dict of the same keys.
+
+    Every fetch carries the `generation` of the fetcher when it was started.  Once the
+    fetcher is superseded, the fetch stops before its next request and raises
+    Superseded, so that it cannot overwrite the result of a later fetch.
+    """
+    generation = 0
+
+    def __init__(self, settings):
+        self.settings = settings
+
+    def supersede(self):
+        self.generation += 1
+
+    def check_generation(self, generation):
+        if generation is not None and generation != self.generation:
+            raise Superseded()
+
+    def fetch(self, repo_context, tracking_branch, executor, verbose=False, generation=None):
+        """
+        Fetch the Build of the head of `tracking_branch`, submitting the requests which
+        do not depend on each other to `executor`.  Return the build and the rate limit
+        resource it was fetched with, or None if the branch cannot be fetched.  May
+        raise RateLimitExceeded, Superseded and FetchFailed; a build missing the checks
+        of a failed request is never returned.
+        """
+        resource = "core"
+        result = None
+        if self.settings.get("backend", "rest") == "graphql":
+            result = self.query_check_rollup(
+                repo_context, tracking_branch, verbose=verbose, generation=generation)
+            if result is not None:
+                resource = "graphql"
+        if result is None:
+            try:
+                result = self.query_checks(
+                    repo_context, tracking_branch, executor, verbose=verbose,
+                    generation=generation)
+            except REQUEST_ERRORS as e:
+                raise FetchFailed("network error: {}".format(e))
+        if result is None:
+            return None
+
+        sha, checks = result
+        build = Build.from_dicts(sha, checks)
+        build.merge((), removed=self.settings.get("ignore_services", []))
+        return build, resource
+
+    def query_checks(self, repo_context, tracking_branch, executor, verbose=False,
+                     generation=None):
+        tracking_commit = self.query_branch_sha(repo_context, tracking_branch, verbose=verbose)
+        if not tracking_commit:
+            return
+        self.check_generation(generation)
+
+        check_runs = self.settings.get("check_runs", "apps")
+        checks = {}
+        status_future = executor.submit(
+            self.query_status, repo_context, tracking_branch, tracking_commit, verbose=verbose)
+        if check_runs == "all":
+            # one paginated check runs request replaces a jobs request per workflow run
+            suites_future = executor.submit(
+                self.query_check_suites, repo_context, tracking_commit, verbose=verbose)
+            workflow_runs = self.query_runs(
+                repo_context, tracking_branch, tracking_commit, verbose=verbose)
+            suites = suites_future.result()
+            self.check_generation(generation)
+            all_checks = self.query_check_runs(
+                repo_context, tracking_commit, workflow_runs, suites=suites, verbose=verbose)
+            if all_checks is None:
+                # too many check runs to list them all, read the jobs instead
+                self.check_generation(generation)
+                check_runs_future = executor.submit(
+                    self.query_check_runs, repo_context, tracking_commit, suites=suites,
+                    verbose=verbose)
+                all_checks = self.query_workflows(
+                    repo_context, tracking_branch, tracking_commit, verbose=verbose,
+                    executor=executor, generation=generation, workflow_runs=workflow_runs)
+                all_checks.update(check_runs_future.result())
+            checks.update(all_checks)
+        else:
+            if check_runs == "apps":
+                check_runs_future = executor.submit(
+                    self.query_check_runs, repo_context, tracking_commit, verbose=verbose)
+            checks.update(self.query_workflows(
+                repo_context, tracking_branch, tracking_commit, verbose=verbose,
+                executor=executor, generation=generation))
+            if check_runs == "apps":
+                checks.update(check_runs_future.result())
+        checks.update(status_future.result())
+
+        return tracking_commit, checks
+
+    def query_check_rollup(self, repo_context, tracking_branch, verbose=False,
+                           generation=None):
+        """
+        Fetch every check run and status of the branch head in a single GraphQL query.
+        Return the (sha, checks) of the head, or None if it is not possible, e.g. there
+        is no token for the host or the branch does not exist.
+        """
+        debug = self.settings.get("debug", False)
+
+        if not repo_context.token:
+            if verbose or debug:
+                print("graphql api requires a token")
+            return
+
+        variables = {
+            "owner": repo_context.owner,
+            "repo": repo_context.repo,
+            "ref": "refs/heads/" + tracking_branch,
+            "cursor": None
+        }
+
+        if debug:
+            print("fetching from github graphql api: {}/{}".format(
+                    repo_context.owner, repo_context.repo))
+
+        checks = {}
+        while True:
+            try:
+                response = query_graphql(CHECK_ROLLUP_QUERY, variables, repo_context)
+            except REQUEST_ERRORS:
+                if verbose or debug:
+                    print("network error")
+                return
+
+            if response.status != 200 or not response.is_json or "errors" in response.payload:
+                if verbose or debug:
+                    print("request status: {:d}".format(response.status))
+                    if debug:
+                        print(response.payload)
+                return
+
+            ref = response.payload["data"]["repository"]["ref"]
+            if not ref:
+                if verbose or debug:
+                    print("branch {} not found".format(tracking_branch))
+                return
+            sha = ref["target"].get("oid")
+            rollup = ref["target"].get("statusCheckRollup")
+            if not rollup:
+                # the commit exists but has no checks
+                return sha, checks
+
+            for node in rollup["contexts"]["nodes"]:
+                if node["__typename"] == "CheckRun":
+                    check_suite = node["checkSuite"] or {}
+                    workflow_run = check_suite.get("workflowRun")
+                    if workflow_run:
+                        if workflow_run["event"] != "push":
+                            continue
+                        context = workflow_run["workflow"]["name"] + " / " + node["name"]
+                        job_id = node.get("databaseId")
+                    else:
+                        context = node["name"]
+                        job_id = None
+                    state = check_state(
+                        node["status"].lower(), (node["conclusion"] or "").lower())
+                    created_at = check_time(node["startedAt"], check_suite.get("createdAt"))
+                    checks[context] = {
+                        "state": state,
+                        "context": context,
+                        "description": state,
+                        "target_url": node["detailsUrl"],
+                        "created_at": created_at,
+                        "updated_at": node["completedAt"] or created_at,
+                        "job_id": job_id
+                    }
+                elif node["__typename"] == "StatusContext":
+                    context = node["context"]
+                    state = node["state"].lower()
+                    checks[context] = {
+                        "state": "pending" if state == "expected" else state,
+                        "context": context,
+                        "description": node["description"],
+                        "target_url": node["targetUrl"],
+                        "created_at": node["createdAt"],
+                        "updated_at": node["createdAt"]
+                    }
+
+            page_info = rollup["contexts"]["pageInfo"]
+            if not page_info["hasNextPage"]:
+                return sha, checks
+            variables["cursor"] = page_info["endCursor"]
+            self.check_generation(generation)
+
+    def query_branch_sha(self, repo_context, tracking_branch, verbose=False):
+        debug = self.settings.get("debug", False)
+
+        path = "/repos/{owner}/{repo}/branches/{branch}".format(
+            owner=repo_context.owner,
+            repo=repo_context.repo,
+            branch=tracking_branch
+        )
+
+        if debug:
+            print("fetching from github branches api: {}/{}".format(
+                    repo_context.owner, repo_context.repo))
+        response = query_github(path, repo_context)
+        check_response(response)
+
+        if response.status == 200 and response.is_json:
+            return response.payload["commit"]["sha"]
+        else:
+            return
+
+    def query_runs(self, repo_context, tracking_branch, tracking_commit, verbose=False):
+        debug = self.settings.get("debug", False)
+
+        headers = {"Accept": "application/vnd.github.v3+json"}
+
+        path = ("/repos/{owner}/{repo}/actions/runs"
+                "?branch={branch}&head_sha={sha}&event=push&per_page=100").format(
+            owner=repo_context.owner,
+            repo=repo_context.repo,
+            branch=quote(tracking_branch, safe=""),
+            sha=tracking_commit
+        )
+
+        if debug:
+            print("fetching from github actions/runs api: {}/{}".format(
+                    repo_context.owner, repo_context.repo))
+        response = query_github_paginated(
+            path, repo_context, headers=headers, key="workflow_runs")
+        check_response(response)
+
+        if response.status == 200 and response.is_json:
+            # older GHE versions ignore the head_sha and event filters
+            return [
+                run for run in response.payload["workflow_runs"]
+                if run["head_sha"] == tracking_commit and run["event"] == "push"]
+        else:
+            if verbose or debug:
+                print("request status: {:d}".format(response.status))
+                if debug:
+                    print(response.payload)
+            return []
+
+    def query_workflows(self, repo_context, tracking_branch, tracking_commit, verbose=False,
+                        executor=None, generation=None, workflow_runs=None):
+        if workflow_runs is None:
+            workflow_runs = self.query_runs(
+                repo_context, tracking_branch, tracking_commit, verbose=verbose)
+
+        if executor:
+            futures = [
+                executor.submit(
+                    self.query_jobs, repo_context, run["name"], run["id"], verbose=verbose,
+                    generation=generation)
+                for run in workflow_runs]
+            results = [future.result() for future in futures]
+        else:
+            results = [
+                self.query_jobs(
+                    repo_context, run["name"], run["id"], verbose=verbose,
+                    generation=generation)
+                for run in workflow_runs]
+
+        checks = {}
+        for run, workflow_checks in zip(workflow_runs, results):
+            for check in workflow_checks:
+                workflow_checks[check]["created_at"] = run["created_at"]
+                workflow_checks[check]["updated_at"] = run["updated_at"]
+
+            checks.update(workflow_checks)
+
+        return checks
+
+    def query_jobs(self, repo_context, run_name, run_id, verbose=False, generation=None):
+        # the jobs of a superseded fetch may still be queued
+        self.check_generation(generation)
+        debug = self.settings.get("debug", False)
+
+        headers = {"Accept": "application/vnd.github.v3+json"}
+
+        path = "/repos/{owner}/{repo}/actions/runs/{run_id}/jobs?per_page=100".format(
+            owner=repo_context.owner,
+            repo=repo_context.repo,
+            run_id=run_id
+        )
+        if debug:
+            print("fetching from github actions/runs/jobs api: {}/{}".format(
+                    repo_context.owner, repo_context.repo))
+        response = query_github_paginated(
+            path, repo_context, headers=headers, key="jobs")
+        check_response(response)
+
+        checks = {}
+        if response.status == 200 and response.is_json:
+            if response.payload["total_count"] > 0:
+                jobs = response.payload["jobs"]
+                for job in jobs:
+                    context = run_name + " / " + job["name"]
+                    state = check_state(job["status"], job["conclusion"])
+
+                    checks[context] = {
+                        "state": state,
+                        "context": context,
+                        "description": state,
+                        "target_url": job["html_url"],
+                        "job_id": job["id"]
+                    }
+
+        return checks
+
+    def query_check_suites(self, repo_context, tracking_commit, verbose=False):
+        """
+        The check suites of the commit, one for each app which may post check runs.
+        """
+        debug = self.settings.get("debug", False)
+
+        # the preview media type is still required by older GHE versions
+        headers = {"Accept": "application/vnd.github.antiope-preview+json"}
+
+        if debug:
+            print("fetching from github check-suites api: {}/{}".format(
+                    repo_context.owner, repo_context.repo))
+        response = query_github_paginated(
+            "/repos/{owner}/{repo}/commits/{sha}/check-suites?per_page=100".format(
+                owner=repo_context.owner, repo=repo_context.repo, sha=tracking_commit),
+            repo_context, headers=headers, key="check_suites")
+        check_response(response)
+        if response.status != 200 or not response.is_json:
+            if verbose or debug:
+                print("request status: {:d}".format(response.status))
+                if debug:
+                    print(response.payload)
+            return []
+        return response.payload["check_suites"]
+
+    def query_check_runs(self, repo_context, tracking_commit, workflow_runs=None,
+                         suites=None, verbose=False):
+        """
+        Checks posted through the check runs api.  Without `workflow_runs`, the check
+        runs of apps other than GitHub Actions are read suite by suite.  With it, all
+        check runs of the commit are read at once, and those of GitHub Actions are named
+        after their workflow run, like the jobs returned by `query_jobs`; None is
+        returned if there are more of them than can be listed.  The check `suites` of
+        the commit are fetched unless given.
+        """
+        debug = self.settings.get("debug", False)
+
+        if suites is None:
+            suites = self.query_check_suites(repo_context, tracking_commit, verbose=verbose)
+
+        # the preview media type is still required by older GHE versions
+        headers = {"Accept": "application/vnd.github.antiope-preview+json"}
+
+        if debug:
+            print("fetching from github check-runs api: {}/{}".format(
+                    repo_context.owner, repo_context.repo))
+        if workflow_runs is None:
+            check_runs = []
+            for suite in suites:
+                if (suite["app"]["slug"] == "github-actions" or
+                        not suite["latest_check_runs_count"]):
+                    continue
+                response = query_github_paginated(
+                    "/repos/{owner}/{repo}/check-suites/{id}/check-runs"
+                    "?per_page=100".format(
+                        owner=repo_context.owner, repo=repo_context.repo,
+                        id=suite["id"]),
+                    repo_context, headers=headers, key="check_runs")
+                check_response(response)
+                if response.status == 200 and response.is_json:
+                    check_runs.extend(response.payload["check_runs"])
+        else:
+            response = query_github_paginated(
+                "/repos/{owner}/{repo}/commits/{sha}/check-runs?per_page=100".format(
+                    owner=repo_context.owner, repo=repo_context.repo,
+                    sha=tracking_commit),
+                repo_context, headers=headers, key="check_runs", complete=True)
+            if response is None:
+                if verbose or debug:
+                    print("too many check runs to list")
+                return None
+            check_response(response)
+            if response.status != 200 or not response.is_json:
+                if verbose or debug:
+                    print("request status: {:d}".format(response.status))
+                    if debug:
+                        print(response.payload)
+                return {}
+            check_runs = response.payload["check_runs"]
+            if len(check_runs) < response.payload["total_count"]:
+                if verbose or debug:
+                    print("{:d} of {:d} check runs listed".format(
+                        len(check_runs), response.payload["total_count"]))
+                return None
+
+        runs_by_suite = {run["check_suite_id"]: run for run in workflow_runs or []}
+        suites_by_id = {suite["id"]: suite for suite in suites}
+
+        checks = {}
+        for check_run in check_runs:
+            state = check_state(check_run["status"], check_run["conclusion"])
+            description = (check_run.get("output") or {}).get("title") or state
+            if check_run["app"]["slug"] == "github-actions":
+                # deduplicate against the jobs of the workflow runs
+                run = runs_by_suite.get(check_run["check_suite"]["id"])
+                if not run:
+                    continue
+                context = run["name"] + " / " + check_run["name"]
+                created_at = run["created_at"]
+                updated_at = run["updated_at"]
+                # the check run of a job shares its id
+                job_id = check_run["id"]
+            else:
+                context = check_run["name"]
+                job_id = None
+                suite = suites_by_id.get(check_run["check_suite"]["id"], {})
+                created_at = check_time(check_run["started_at"], suite.get("created_at"))
+                updated_at = check_run["completed_at"] or created_at
+
+            checks[context] = {
+                "state": state,
+                "context": context,
+                "description": description,
+                "target_url": check_run["html_url"],
+                "created_at": created_at,
+                "updated_at": updated_at,
+                "job_id": job_id
+            }
+
+        # suites of apps which have not created any check run yet
+        for suite in suites:
+            if suite["app"]["slug"] == "github-actions":
+                continue
+            if suite["status"] == "completed" or suite["latest_check_runs_count"]:
+                continue
+            context = suite["app"]["name"]
+            checks[context] = {
+                "state": "pending",
+                "context": context,
+                "description": suite["status"],
+                "target_url": commit_checks_url(
+                    repo_context.fqdn, repo_context.owner, repo_context.repo,
+                    tracking_commit),
+                "created_at": suite["created_at"],
+                "updated_at": suite["updated_at"]
+            }
+
+        return checks
+
+    def query_status(self, repo_context, tracking_branch, tracking_commit, verbose=False):
+        debug = self.settings.get("debug", False)
+
+        path = "/repos/{owner}/{repo}/commits/{sha}/status".format(
+            owner=repo_context.owner,
+            repo=repo_context.repo,
+            sha=tracking_commit
+        )
+
+        if debug:
+            print("fetching from github status api: {}/{}".format(
+                    repo_context.owner, repo_context.repo))
+        response = query_github(path, repo_context)
+        check_response(response)
+
+        checks = {}
+        if response.status == 200 and response.is_json:
+            for status in response.payload["statuses"]:
+                context = status["context"]
+                checks[context] = {
+                    "state": status["state"],
+                    "context": status["context"],
+                    "description": status["description"],
+                    "target_url": status["target_url"],
+                    "created_at": status["created_at"],
+                    "updated_at": status["updated_at"]
+                }
+        else:
+            if verbose or debug:
+                print("request status: {:d}".format(response.status))
+                if debug:
+                    print(response.payload)
+            return {}
+
+        return checks
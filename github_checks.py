@@ -2,15 +2,27 @@ import sublime
 import sublime_plugin
 import subprocess
 import threading
+from collections import OrderedDict
 from datetime import datetime
 import time
 import os
-import socket
+import traceback
+import re
 import webbrowser
 
-from .utils import dates
+from .utils import dates, gitrepo
+from .utils.buildcache import BuildCache
+from .utils.checks import Build, Check, State
+from .utils.eta import DurationHistory
+from .utils.loop import EventLoop
 from .utils.badge import DynamicBadge
-from .query.github import query_github, parse_remote_url
+from .query import interwebs, telemetry
+from .query.github import (
+    RepoContext, check_time, query_job_log, parse_remote_url, rate_limit_budget)
+from .query.interwebs import REQUEST_ERRORS
+from .query.ratelimit import RateLimitExceeded
+from .query.webhooks import WebhookReceiver, commit_checks_url
+from .core.fetcher import ChecksFetcher, FetchFailed, RepoKey, Superseded, count_states
 
 
 URL_POPUP = """
@@ -38,11 +50,43 @@ def parse_time(time_string):
     return datetime.strptime(time_string, "%Y-%m-%dT%H:%M:%SZ")
 
 
+_settings = None
+# RepoContext by remote url
+repo_contexts = {}
+
+
+def settings():
+    """
+    The settings of the package, loaded once.  The resolved RepoContexts are dropped
+    whenever the settings change.
+    """
+    global _settings
+    if not _settings:
+        _settings = sublime.load_settings("github_checks.sublime-settings")
+        _settings.add_on_change("github_checks", repo_contexts.clear)
+    return _settings
+
+
+def resolve_repo_context(remote_url):
+    """
+    The RepoContext of `remote_url`, or None if it is not a GitHub url.  A changed remote
+    url in the git config resolves to a new context.
+    """
+    repo_context = repo_contexts.get(remote_url)
+    if not repo_context:
+        github_repo = parse_remote_url(remote_url)
+        if not github_repo:
+            return None
+        token = settings().get("token", {}).get(github_repo.fqdn)
+        repo_context = RepoContext.resolve(github_repo, token)
+        repo_contexts[remote_url] = repo_context
+    return repo_context
+
+
 class GitCommand:
 
     def github_checks_settings(self, key, default=None):
-        s = sublime.load_settings("github_checks.sublime-settings")
-        return s.get(key, default)
+        return settings().get(key, default)
 
     def git(self, cmd, cwd=None):
         plat = sublime.platform()
@@ -88,301 +132,472 @@ class GitCommand:
                 cwd = window.folders()[0]
         return cwd
 
-    def branch(self):
-        return self.git(["symbolic-ref", "HEAD", "--short"])
-
-
-builds = {}
-
-
-class GithubChecksFetchCommand(GitCommand, sublime_plugin.WindowCommand):
-    timer = None
-    thread = None
-    last_fetch_time = 0
-    _branch = None
-    folders = None
-
-    def run(self, force=False, verbose=False):
-        window = self.window
-        if self.folders and self.folders != window.folders():
-            force = True
-
-        branch = self.branch()
-        if self._branch and self._branch != branch:
-            force = True
-
-        if force and window.id() in builds:
-            del builds[window.id()]
+    def branch(self, cwd=None, spawn=True):
+        if not cwd:
+            cwd = self.getcwd()
+        try:
+            return gitrepo.head_branch(cwd)
+        except gitrepo.NotARepository:
+            return None
+        except (gitrepo.Unsupported, OSError):
+            if not spawn:
+                raise
+            return self.git(["symbolic-ref", "HEAD", "--short"], cwd=cwd)
+
+    def git_config(self, key, cwd=None, spawn=True):
+        if not cwd:
+            cwd = self.getcwd()
+        try:
+            return gitrepo.config(cwd, key)
+        except gitrepo.NotARepository:
+            return None
+        except (gitrepo.Unsupported, OSError):
+            if not spawn:
+                raise
+            return self.git(["config", key], cwd=cwd)
+
+    def repo_key(self, cwd=None, verbose=False, spawn=True):
+        """
+        Resolve the GitHub repo and branch tracked by the current branch of `cwd`.
+        Return a (RepoKey, remote_url) pair, or (None, None).  Unless `spawn`, raise
+        gitrepo.Unsupported or OSError rather than falling back to git.
+        """
+        debug = self.github_checks_settings("debug", False)
 
+        branch = self.branch(cwd, spawn)
         if not branch:
-            if verbose or self.github_checks_settings("debug", False):
+            if verbose or debug:
                 print("branch not found")
-            return
-
-        cooldown = self.github_checks_settings("cooldown", 60)
-        if not force and time.time() - self.last_fetch_time < cooldown:
-            return
-
-        if time.time() - self.last_fetch_time < 1:
-            # still, avoid too frequent refresh
-            return
-
-        self.folders = window.folders()
-        self.last_fetch_time = time.time()
-        self._branch = branch
-
-        if force and self.timer:
-            self.timer.cancel()
-            self.timer = None
-
-        if not self.timer:
-            self.thread = threading.Thread(target=lambda: self.run_async(force, verbose))
-            self.thread.start()
+            return None, None
 
-    def run_async(self, force=False, verbose=False):
-        debug = self.github_checks_settings("debug", False)
-
-        window = self.window
-        if not window:
-            return
-
-        remote = self.git(["config", "branch.{}.remote".format(self._branch)])
+        remote = self.git_config("branch.{}.remote".format(branch), cwd, spawn)
         if not remote:
             if verbose or debug:
                 print("remote not found")
-            return
-        remote_url = self.git(["config", "remote.{}.url".format(remote)])
+            return None, None
+        remote_url = self.git_config("remote.{}.url".format(remote), cwd, spawn)
         if not remote_url:
-            return
+            return None, None
 
-        tracking_branch = self.git(["config", "branch.{}.merge".format(self._branch)])
+        tracking_branch = self.git_config("branch.{}.merge".format(branch), cwd, spawn)
         if not tracking_branch or not tracking_branch.startswith("refs/heads/"):
-            return
+            return None, None
         tracking_branch = tracking_branch.replace("refs/heads/", "")
 
-        tracking_commit = self.query_branch_sha(remote_url, tracking_branch, verbose=verbose)
-        if not tracking_commit:
-            return
+        repo_context = resolve_repo_context(remote_url)
+        if not repo_context:
+            return None, None
 
-        checks = {}
-        checks.update(self.query_workflows(
-            remote_url, tracking_branch, tracking_commit, verbose=verbose))
-        checks.update(self.query_status(
-            remote_url, tracking_branch, tracking_commit, verbose=verbose))
+        key = RepoKey(repo_context.fqdn, repo_context.owner, repo_context.repo, tracking_branch)
+        return key, remote_url
 
-        ignore_services = self.github_checks_settings("ignore_services", [])
-        for service in ignore_services:
-            if service in checks:
-                del checks[service]
 
-        if window.id() not in builds:
-            force = True
+# Build by RepoKey
+builds = {}
+# RepoKey of the file of each view
+view_repos = {}
+# RepoKeys of the repositories found in the folders of each window
+window_repos = {}
+# (RepoKey, time) of the active view of each window when it was last resolved
+focused_repos = {}
+# repository worktrees found in each tuple of folders
+discovered_repos = {}
+fetchers = {}
+fetchers_lock = threading.Lock()
+
+
+_duration_history = None
+
+
+def duration_history():
+    global _duration_history
+    if not _duration_history:
+        _duration_history = DurationHistory(
+            os.path.join(sublime.cache_path(), "GitHubChecks", "durations.json"))
+    return _duration_history
+
+
+_background_loop = None
+
+
+def background_loop():
+    global _background_loop
+    if not _background_loop:
+        _background_loop = EventLoop()
+    # the same cap applies to the number of branches fetched at once
+    concurrency = max(1, int(settings().get("concurrency", 4)))
+    _background_loop.set_workers(concurrency, concurrency)
+    interwebs.pool.connect_timeout = settings().get("connect_timeout", 10)
+    interwebs.pool.read_timeout = settings().get("read_timeout", 30)
+    return _background_loop
+
+
+_build_cache = None
+
+
+def build_cache():
+    global _build_cache
+    if not _build_cache:
+        _build_cache = BuildCache(os.path.join(sublime.cache_path(), "GitHubChecks", "builds"))
+    return _build_cache
+
+
+def load_cached_build(key):
+    """
+    Show the last known checks of `key` until they are fetched.
+    """
+    if key in builds:
+        return
+    cached = build_cache().load(key)
+    if cached:
+        sha, checks = cached
+        builds.setdefault(key, Build.from_dicts(sha, checks, stale=True))
+
+
+_webhook_receiver = None
+
+
+def start_webhook_receiver():
+    """
+    Listen for webhook deliveries if a "webhook_port" is set.
+    """
+    global _webhook_receiver
+    s = settings()
+    port = s.get("webhook_port")
+    if port is None or _webhook_receiver:
+        return
+    receiver = WebhookReceiver(port, apply_webhook, secret=s.get("webhook_secret") or None)
+    try:
+        receiver.start()
+    except OSError as e:
+        print("GitHub Checks: cannot listen for webhooks on port {}: {}".format(port, e))
+        return
+    _webhook_receiver = receiver
+
+
+def apply_webhook(update):
+    """
+    Apply a webhook Update to the builds of its commit.  A commit that is not known yet
+    is fetched in full if it was pushed to a watched branch.
+    """
+    with fetchers_lock:
+        watched = [fetcher for key, fetcher in fetchers.items()
+                   if (key.fqdn, key.owner, key.repo) == (update.fqdn, update.owner, update.repo)]
+
+    placeholder_url = commit_checks_url(update.fqdn, update.owner, update.repo, update.sha)
+    for fetcher in watched:
+        build = builds.get(fetcher.key)
+        if not build or build.sha != update.sha:
+            if fetcher.key.branch in update.branches:
+                fetcher.run(force=True)
+            continue
+
+        removed = [context for context in update.removed
+                   if context in build.checks and
+                   build.checks[context].target_url == placeholder_url]
+        checks = [Check.from_dict(check) for check in update.checks.values()]
+        for check in checks:
+            if not check.created_at:
+                previous = build.checks.get(check.context)
+                check.created_at = check_time(previous.created_at if previous else None)
+                check.updated_at = check.updated_at or check.created_at
+        build = build.copy()
+        if build.merge(checks, removed):
+            fetcher.update(build)
+
+
+def subscribed_views(key):
+    """
+    The views showing the checks of `key`: the views of its files for the badge, and the
+    active view of every window listing it in the output panel.
+    """
+    views = [view for window in sublime.windows() for view in window.views()
+             if view_repos.get(view.id()) == key]
+    for window in sublime.windows():
+        view = window.active_view()
+        if view and view not in views and key in window_repos.get(window.id(), []):
+            views.append(view)
+    return views
 
-        builds[window.id()] = {
-            "checks": checks
-        }
-        pending = sum(status["state"] == "pending" for status in checks.values())
 
-        if checks and pending:
-            self.timer = threading.Timer(
-                int(self.github_checks_settings("refresh", 30)),
-                lambda: sublime.set_timeout(
-                    lambda: window.run_command("github_checks_fetch", {"force": True})))
-            self.timer.start()
+class GithubChecksFetchCommand(GitCommand, sublime_plugin.WindowCommand):
 
-        view = window.active_view()
+    def run(self, force=False, verbose=False):
+        view = self.window.active_view()
+        folders = tuple(self.window.folders())
+        cwd = self.getcwd()
+        try:
+            # resolved right away, so that a render following the command finds the repo
+            # of the view and its cached checks
+            key, remote_url = self.repo_key(cwd, verbose=verbose, spawn=False)
+        except (gitrepo.Unsupported, OSError):
+            # git is needed, do not block the UI thread on it
+            background_loop().io.submit(self.resolve_async, view, cwd, folders, force, verbose)
+            return
+        self.focus(view, key)
+        background_loop().io.submit(
+            self.run_async, view, key, remote_url, folders, force, verbose)
+
+    def resolve_async(self, view, cwd, folders=(), force=False, verbose=False):
+        key, remote_url = self.repo_key(cwd, verbose=verbose)
+        self.focus(view, key)
+        self.run_async(view, key, remote_url, folders, force, verbose, render=True)
+
+    def focus(self, view, key):
         if view:
-            sublime.set_timeout(
-                lambda: view.run_command("github_checks_render", {"force": force}), 300)
+            if key:
+                view_repos[view.id()] = key
+            else:
+                view_repos.pop(view.id(), None)
+            focused_repos[self.window.id()] = (key, time.time())
+        if key:
+            load_cached_build(key)
+
+    def run_async(self, view, key, remote_url, folders=(), force=False, verbose=False,
+                  render=False):
+        # remote url by RepoKey
+        repos = OrderedDict()
+        if self.github_checks_settings("discover_repos", True):
+            for path in self.discover_repos(folders, force):
+                repo_key, repo_url = self.repo_key(path)
+                if repo_key:
+                    repos.setdefault(repo_key, repo_url)
+        if key:
+            repos.setdefault(key, remote_url)
+        previous = window_repos.get(self.window.id(), [])
+        window_repos[self.window.id()] = list(repos)
+
+        for key in previous:
+            if key not in repos and not subscribed_views(key):
+                # e.g. the branch was switched, the checks of the old one are not needed
+                with fetchers_lock:
+                    fetcher = fetchers.get(key)
+                if fetcher:
+                    fetcher.supersede()
+
+        for key, remote_url in repos.items():
+            load_cached_build(key)
+            RepoFetcher.get(key, remote_url).run(force, verbose)
+
+        if view and (render or list(repos) != previous):
+            # list the cached checks of the repositories found in the output panel, and
+            # show those of the view once it was resolved late
+            sublime.set_timeout(lambda: view.run_command("github_checks_render"))
+
+    def discover_repos(self, folders, force=False):
+        """
+        The worktrees of the repositories and submodules in `folders`, looked up again
+        on a forced fetch only.
+        """
+        if force or folders not in discovered_repos:
+            discovered_repos[folders] = gitrepo.find_repos(folders)
+        return discovered_repos[folders]
+
+
+class RepoFetcher(GitCommand, ChecksFetcher):
+    """
+    Fetch the checks of a GitHub branch on behalf of every window and view showing it.
+    There is one fetcher per RepoKey, so that a branch is never polled twice.  The
+    result of a superseded fetch is discarded.
+    """
+    timer = None
+    future = None
+    future_generation = 0
+    last_fetch_time = 0
 
-        if verbose:
-            window.status_message("GitHub Checks refreshed.")
+    def __init__(self, key, remote_url):
+        ChecksFetcher.__init__(self, settings())
+        self.key = key
+        self.remote_url = remote_url
+        self.lock = threading.Lock()
 
-    def query_branch_sha(self, remote_url, tracking_branch, verbose=False):
-        debug = self.github_checks_settings("debug", False)
+    @classmethod
+    def get(cls, key, remote_url):
+        with fetchers_lock:
+            if key not in fetchers:
+                fetchers[key] = cls(key, remote_url)
+            fetcher = fetchers[key]
+            fetcher.remote_url = remote_url
+            return fetcher
 
-        token = self.github_checks_settings("token", {})
-        github_repo = parse_remote_url(remote_url)
-        token = token[github_repo.fqdn] if github_repo.fqdn in token else None
+    def repo_context(self):
+        return resolve_repo_context(self.remote_url)
 
-        path = "/repos/{owner}/{repo}/branches/{branch}".format(
-            owner=github_repo.owner,
-            repo=github_repo.repo,
-            branch=tracking_branch
-        )
+    def run(self, force=False, verbose=False):
+        with self.lock:
+            if (self.future and not self.future.done() and
+                    self.future_generation == self.generation):
+                # a fetch of the same branch is in flight already
+                return
+
+            cooldown = self.github_checks_settings("cooldown", 60)
+            if not force and time.time() - self.last_fetch_time < cooldown:
+                return
+
+            if time.time() - self.last_fetch_time < 1:
+                # still, avoid too frequent refresh
+                return
+
+            self.last_fetch_time = time.time()
+
+            if force and self.timer:
+                self.timer.cancel()
+                self.timer = None
+
+            if not self.timer:
+                self.future_generation = self.generation
+                self.future = background_loop().run_in_worker(
+                    self.run_async, force, verbose, self.generation)
+
+    def supersede(self):
+        """
+        Abort the fetch in flight, if any, and stop polling.
+        """
+        with self.lock:
+            ChecksFetcher.supersede(self)
+            if self.timer:
+                self.timer.cancel()
+                self.timer = None
+
+    def run_async(self, force=False, verbose=False, generation=None):
+        try:
+            self.fetch_and_update(force, verbose, generation)
+        except Exception:
+            # nobody waits for the result of the fetch, do not let the error pass silently
+            # and keep polling, the error may well be transient
+            traceback.print_exc()
+            if subscribed_views(self.key):
+                self.schedule_refresh(int(self.github_checks_settings("refresh", 30)))
+
+    def fetch_and_update(self, force=False, verbose=False, generation=None):
+        debug = self.github_checks_settings("debug", False)
+        if generation is None:
+            generation = self.generation
+
+        repo_context = self.repo_context()
+        if not repo_context:
+            return
 
-        if debug:
-            print("fetching from github branches api: {}/{}".format(
-                    github_repo.owner, github_repo.repo))
         try:
-            response = query_github(path, github_repo, token)
-        except socket.gaierror:
+            result = self.fetch(
+                repo_context, self.key.branch, background_loop().io, verbose=verbose,
+                generation=generation)
+        except Superseded:
+            if debug:
+                print("fetch of {}/{}@{} superseded".format(
+                    self.key.owner, self.key.repo, self.key.branch))
+            return
+        except RateLimitExceeded as e:
             if verbose or debug:
-                print("network error")
+                print(e)
+            if verbose:
+                sublime.status_message("GitHub Checks: {}.".format(e))
+            self.schedule_refresh(e.wait)
             return
-
-        if response.status == 200 and response.is_json:
-            return response.payload["commit"]["sha"]
-        else:
+        except FetchFailed as e:
+            # keep the previous build rather than one missing the checks of the failed
+            # request, and try again
+            if verbose or debug:
+                print("cannot fetch {}/{}@{}: {}".format(
+                    self.key.owner, self.key.repo, self.key.branch, e))
+            if verbose:
+                sublime.status_message("GitHub Checks: {}.".format(e))
+            result = None
+        if result is None:
+            if subscribed_views(self.key):
+                self.schedule_refresh(int(self.github_checks_settings("refresh", 30)))
             return
 
-    def query_workflows(self, remote_url, tracking_branch, tracking_commit, verbose=False):
+        build, resource = result
+        self.update(
+            build, force=force, resource=resource, verbose=verbose, generation=generation)
+
+    def update(self, build, force=False, resource="core", verbose=False, generation=None):
+        """
+        Store the Build of the branch head, and render it in the subscribed views if it
+        changed.  Keep polling while some checks are pending.  The build of a superseded
+        `generation` is discarded.
+        """
         debug = self.github_checks_settings("debug", False)
 
-        token = self.github_checks_settings("token", {})
-        github_repo = parse_remote_url(remote_url)
-        token = token[github_repo.fqdn] if github_repo.fqdn in token else None
-        headers = {"Accept": "application/vnd.github.v3+json"}
-
-        path = "/repos/{owner}/{repo}/actions/runs?branch={branch}".format(
-            owner=github_repo.owner,
-            repo=github_repo.repo,
-            branch=tracking_branch
-        )
-
-        if debug:
-            print("fetching from github actions/runs api: {}/{}".format(
-                    github_repo.owner, github_repo.repo))
-        try:
-            response = query_github(path, github_repo, token, headers=headers)
-        except socket.gaierror:
-            if verbose or debug:
-                print("network error")
-            return {}
-
-        checks = {}
-        if response.status == 200 and response.is_json:
-            if response.payload["total_count"] > 0:
-                workflow_runs = response.payload["workflow_runs"]
-                for run in workflow_runs:
-                    if run["head_commit"]["id"] != tracking_commit:
-                        continue
-                    if run["event"] != "push":
-                        continue
-                    name = run["name"]
-                    run_id = run["id"]
-                    workflow_checks = self.query_jobs(remote_url, name, run_id, verbose=verbose)
-                    for check in workflow_checks:
-                        workflow_checks[check]["created_at"] = run["created_at"]
-                        workflow_checks[check]["updated_at"] = run["updated_at"]
+        build.merge((), removed=self.github_checks_settings("ignore_services", []))
 
-                    checks.update(workflow_checks)
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return
+            previous = builds.get(self.key)
+            builds[self.key] = build
+        changed = not previous or previous.fingerprint != build.fingerprint
+        if not previous or previous.stale:
+            force = True
 
-        else:
-            if verbose or debug:
-                print("request status: {:d}".format(response.status))
+        repo = "{}/{}/{}".format(self.key.fqdn, self.key.owner, self.key.repo)
+        history = duration_history()
+        if changed:
+            try:
+                build_cache().save(self.key, build.sha, build.as_dicts())
+            except (OSError, ValueError) as e:
+                if debug:
+                    print("cannot save checks: {}".format(e))
+            try:
+                history.record(repo, build.checks)
+                history.save()
+            except (OSError, ValueError) as e:
                 if debug:
-                    print(response.payload)
-            return {}
+                    print("cannot record check durations: {}".format(e))
 
-        return checks
+        views = subscribed_views(self.key)
 
-    def query_jobs(self, remote_url, run_name, run_id, verbose=False):
-        debug = self.github_checks_settings("debug", False)
+        if build.checks and build.counts[State.PENDING] and views:
+            refresh = int(self.github_checks_settings("refresh", 30))
+            if self.github_checks_settings("adaptive_refresh", True):
+                refresh = history.refresh_delay(repo, build.checks, refresh)
+            budget = rate_limit_budget(self.repo_context(), resource)
+            self.schedule_refresh(budget.refresh_interval(refresh))
 
-        token = self.github_checks_settings("token", {})
-        github_repo = parse_remote_url(remote_url)
-        token = token[github_repo.fqdn] if github_repo.fqdn in token else None
-        headers = {"Accept": "application/vnd.github.v3+json"}
-
-        path = "/repos/{owner}/{repo}/actions/runs/{run_id}/jobs".format(
-            owner=github_repo.owner,
-            repo=github_repo.repo,
-            run_id=run_id
-        )
-        if debug:
-            print("fetching from github actions/runs/jobs api: {}/{}".format(
-                    github_repo.owner, github_repo.repo))
-        try:
-            response = query_github(path, github_repo, token, headers=headers)
-        except socket.gaierror:
-            if verbose or debug:
-                print("network error")
-            return {}
-
-        checks = {}
-        if response.status == 200 and response.is_json:
-            if response.payload["total_count"] > 0:
-                jobs = response.payload["jobs"]
-                for job in jobs:
-                    context = run_name + " / " + job["name"]
-                    status = job["status"]
-                    if status == "completed":
-                        conclusion = job["conclusion"]
-                        if conclusion == "success":
-                            state = "success"
-                        elif conclusion == "failure":
-                            state = "failure"
-                        elif conclusion == "neutral":
-                            state = "neutral"
-                        elif conclusion == "skipped":
-                            state = "skipped"
-                        else:
-                            state = "error"
-                    else:
-                        state = "pending"
-
-                    checks[context] = {
-                        "state": state,
-                        "context": context,
-                        "description": state,
-                        "target_url": job["html_url"]
-                    }
-
-        return checks
-
-    def query_status(self, remote_url, tracking_branch, tracking_commit, verbose=False):
-        debug = self.github_checks_settings("debug", False)
-
-        token = self.github_checks_settings("token", {})
-        github_repo = parse_remote_url(remote_url)
-        token = token[github_repo.fqdn] if github_repo.fqdn in token else None
+        if changed or force:
+            for view in views:
+                sublime.set_timeout(
+                    lambda view=view: view.run_command("github_checks_render", {"force": force}),
+                    300)
 
-        path = "/repos/{owner}/{repo}/commits/{sha}/status".format(
-            owner=github_repo.owner,
-            repo=github_repo.repo,
-            sha=tracking_commit
-        )
+        if verbose:
+            sublime.status_message("GitHub Checks refreshed.")
 
-        if debug:
-            print("fetching from github status api: {}/{}".format(
-                    github_repo.owner, github_repo.repo))
-        try:
-            response = query_github(path, github_repo, token)
-        except socket.gaierror:
-            if verbose or debug:
-                print("network error")
-            return {}
-
-        checks = {}
-        if response.status == 200 and response.is_json:
-            for status in response.payload["statuses"]:
-                context = status["context"]
-                checks[context] = {
-                    "state": status["state"],
-                    "context": status["context"],
-                    "description": status["description"],
-                    "target_url": status["target_url"],
-                    "created_at": status["created_at"],
-                    "updated_at": status["updated_at"]
-                }
-        else:
-            if verbose or debug:
-                print("request status: {:d}".format(response.status))
-                if debug:
-                    print(response.payload)
-            return {}
+    def schedule_refresh(self, delay):
+        with self.lock:
+            if self.timer:
+                self.timer.cancel()
+            self.timer = background_loop().call_later(delay, self.refresh)
 
-        return checks
+    def refresh(self):
+        if _webhook_receiver:
+            silence = _webhook_receiver.silence(self.key.fqdn, self.key.owner, self.key.repo)
+            fallback = self.github_checks_settings("webhook_fallback", 300)
+            if silence is not None and silence < fallback:
+                # the checks are pushed by webhooks, only poll once they have stopped
+                self.schedule_refresh(fallback - silence)
+                return
+        self.run(force=True)
 
 
 badges = {}
 
+ICONS = {
+    State.SUCCESS: "✓",
+    State.FAILURE: "✕",
+    State.ERROR: "⚠",
+    State.NEUTRAL: "∅",
+    State.SKIPPED: "∅",
+    State.PENDING: "⧖"
+}
+
 
 class GithubChecksRenderCommand(sublime_plugin.TextCommand):
 
     last_render_time = 0
-    build = None
+    fingerprint = None
+    panel_fingerprint = None
     render_scheduled = False
 
     def run(self, _, force=False):
@@ -405,15 +620,28 @@ class GithubChecksRenderCommand(sublime_plugin.TextCommand):
         window = view.window()
         if not window:
             return
-        if window.id() not in builds:
+        key = view_repos.get(view.id())
+
+        if window.active_view() == view:
+            # the panel lists every repository of the window
+            keys = list(window_repos.get(window.id(), []))
+            if key and key not in keys:
+                keys.append(key)
+            repos = [(k, builds[k]) for k in keys if k in builds]
+            fingerprint = [(k, build.fingerprint) for k, build in repos]
+            if repos and (force or fingerprint != self.panel_fingerprint):
+                self.panel_fingerprint = fingerprint
+                sublime.set_timeout(lambda: self.update_output_panel(repos))
+
+        if key not in builds:
             if view.id() in badges:
                 badge = badges[view.id()]
                 badge.erase()
                 del badges[view.id()]
             return
 
-        build = builds[window.id()]
-        if not force and build == self.build:
+        build = builds[key]
+        if not force and build.fingerprint == self.fingerprint:
             return
 
         if view.id() not in badges:
@@ -421,21 +649,13 @@ class GithubChecksRenderCommand(sublime_plugin.TextCommand):
 
         badge = badges[view.id()]
 
-        self.build = build
-
-        checks = build["checks"]
-        success = sum(status["state"] == "success" for status in checks.values())
-        failure = sum(status["state"] == "failure" for status in checks.values())
-        error = sum(status["state"] == "error" for status in checks.values())
-        skipped = sum(status["state"] == "skipped" for status in checks.values())
-        pending = sum(status["state"] == "pending" for status in checks.values())
+        self.fingerprint = build.fingerprint
 
-        sublime.set_timeout(
-            lambda: self.update_output_panel(checks, success, failure, error, skipped, pending))
+        success, failure, error, skipped, pending = count_states([build])
 
         if success + failure + error + pending:
             # ignore skipped
-            message = "GitHub "
+            message = "GitHub (cached) " if build.stale else "GitHub "
             if success:
                 message = message + "{:d}✓".format(success)
             if failure + error:
@@ -483,7 +703,11 @@ class GithubChecksRenderCommand(sublime_plugin.TextCommand):
 
         return text
 
-    def update_output_panel(self, checks, success, failure, error, skipped, pending):
+    def update_output_panel(self, repos):
+        """
+        List the checks of `repos`, a list of (RepoKey, build) pairs, grouped by
+        repository when there are several.
+        """
         window = self.view.window()
         if not window:
             return
@@ -496,78 +720,258 @@ class GithubChecksRenderCommand(sublime_plugin.TextCommand):
             output_panel.settings().set("github-checks", True)
             output_panel.set_read_only(True)
 
-        output_panel.settings().set("color_scheme", preferece.get("color_scheme"))
-        output_panel.settings().set("syntax", "github-checks.sublime-syntax")
-        sel = [s for s in output_panel.sel()]
-
-        output_panel.set_read_only(False)
-        output_panel.run_command("select_all")
-        output_panel.run_command("left_delete")
-        output_panel.set_read_only(True)
+        settings = output_panel.settings()
+        if settings.get("color_scheme") != preferece.get("color_scheme"):
+            settings.set("color_scheme", preferece.get("color_scheme"))
+        if settings.get("syntax") != "github-checks.sublime-syntax":
+            settings.set("syntax", "github-checks.sublime-syntax")
 
-        def write(text):
-            output_panel.set_read_only(False)
-            output_panel.run_command("append", {"characters": text})
-            output_panel.set_read_only(True)
+        success, failure, error, skipped, pending = count_states(build for _, build in repos)
+        stale = any(build.stale for _, build in repos)
 
-        write(self.status_summary(success, failure, error, skipped, pending))
+        header = self.status_summary(success, failure, error, skipped, pending)
+        lines = [header]
+        rows = {}
 
         if success + failure + error + pending:
-            last_update_time = max([parse_time(status["updated_at"])
-                                    for status in checks.values()])
-            write(" (" + dates.fuzzy(last_update_time, datetime.utcnow()) + ") ")
+            last_update_time = max([parse_time(check.updated_at)
+                                    for _, build in repos for check in build.checks.values()])
+            header += " (" + dates.fuzzy(last_update_time, datetime.utcnow()) + ") "
+            if stale:
+                header += "[cached, refreshing] "
+            lines = [header, ""]
+
+            for key, build in repos:
+                if len(repos) > 1:
+                    if not build.checks:
+                        continue
+                    lines.append("[{}/{}@{}] {}".format(
+                        key.owner, key.repo, key.branch,
+                        self.status_summary(*count_states([build]))))
+                for _, check in sorted(build.checks.items()):
+                    icon = ICONS.get(check.state, "⧖")
+                    rows[len(lines)] = (key, check.context)
+                    lines.append("{} {} - {}".format(icon, check.context, check.description))
+
+                lines.append("")
+
+        panel_rows[output_panel.id()] = rows
+        previous = panel_lines.get(output_panel.id())
+        if lines == previous:
+            return
 
-            pt = output_panel.line(sublime.Region(0, 0)).end()
+        sel = [s for s in output_panel.sel()]
+        output_panel.run_command("github_checks_update_panel", {"lines": lines})
+        panel_lines[output_panel.id()] = lines
 
+        if not previous or previous[0] != lines[0]:
             output_panel.erase_phantoms("refresh")
 
-            def on_navigate(action):
-                window.run_command("github_checks_fetch", {"force": True, "verbose": True})
-
-            output_panel.add_phantom(
-                "refresh",
-                sublime.Region(pt, pt),
-                "<a href=\"open\">↺</a>",
-                sublime.LAYOUT_INLINE,
-                on_navigate=on_navigate
-            )
-            write("\n\n")
-
-            for i, (_, status) in enumerate(sorted(checks.items())):
-                if status["state"] == "success":
-                    icon = "✓"
-                elif status["state"] == "failure":
-                    icon = "✕"
-                elif status["state"] == "error":
-                    icon = "⚠"
-                elif status["state"] == "netural" or status["state"] == "skipped":
-                    icon = "∅"
-                else:
-                    icon = "⧖"
-
-                write("{} {} - {}\n".format(icon, status["context"], status["description"]))
+            if len(lines) > 1:
+                pt = output_panel.line(sublime.Region(0, 0)).end()
+
+                def on_navigate(action):
+                    window.run_command("github_checks_fetch", {"force": True, "verbose": True})
+
+                output_panel.add_phantom(
+                    "refresh",
+                    sublime.Region(pt, pt),
+                    "<a href=\"open\">↺</a>",
+                    sublime.LAYOUT_INLINE,
+                    on_navigate=on_navigate
+                )
 
         output_panel.sel().clear()
         output_panel.sel().add_all(sel)
         output_panel.show(output_panel.sel())
 
 
-class GithubChecksHandler(sublime_plugin.EventListener):
+class GithubChecksDiagnosticsCommand(sublime_plugin.WindowCommand):
+
+    def run(self):
+        panel = self.window.create_output_panel("GitHub Checks Diagnostics")
+        panel.set_read_only(False)
+        panel.run_command("append", {"characters": telemetry.report()})
+        panel.set_read_only(True)
+        self.window.run_command("show_panel", {"panel": "output.GitHub Checks Diagnostics"})
 
-    def update_build_status(self, view):
-        sublime.set_timeout_async(lambda: self.update_build_status_async(view))
 
-    def update_build_status_async(self, view):
-        if not view:
+LOG_TIMESTAMP = re.compile(r"^\ufeff?\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d(\.\d+)?Z ")
+
+
+class GithubChecksShowLogCommand(GitCommand, sublime_plugin.WindowCommand):
+    """
+    Show the tail of the log of a failed GitHub Actions job of the window in a panel.
+    """
+
+    def run(self):
+        window = self.window
+        view = window.active_view()
+        keys = list(window_repos.get(window.id(), []))
+        key = view_repos.get(view.id()) if view else None
+        if key and key not in keys:
+            keys.insert(0, key)
+
+        failed = [(k, check) for k in keys if k in builds
+                  for _, check in sorted(builds[k].checks.items())
+                  if check.job_id and check.state in (State.FAILURE, State.ERROR)]
+        if not failed:
+            sublime.status_message("GitHub Checks: no failed jobs.")
+            return
+        if len(failed) == 1:
+            self.show(*failed[0])
             return
 
-        window = view.window()
+        def on_done(index):
+            if index >= 0:
+                self.show(*failed[index])
+
+        window.show_quick_panel(
+            [[check.context, "{}/{}@{}".format(k.owner, k.repo, k.branch)]
+             for k, check in failed],
+            on_done)
+
+    def show(self, key, check):
+        sublime.status_message("GitHub Checks: fetching the log of {}...".format(check.context))
+        background_loop().io.submit(self.show_async, key, check)
+
+    def show_async(self, key, check):
+        debug = self.github_checks_settings("debug", False)
+        max_bytes = int(self.github_checks_settings("log_tail", 65536))
+
+        repo_context = resolve_repo_context(
+            "https://{}/{}/{}".format(key.fqdn, key.owner, key.repo))
+
+        try:
+            result = query_job_log(check.job_id, repo_context, max_bytes=max_bytes)
+        except (RateLimitExceeded,) + REQUEST_ERRORS as e:
+            if debug:
+                print("cannot fetch the log of {}: {}".format(check.context, e))
+            sublime.status_message("GitHub Checks: cannot fetch the log: {}.".format(e))
+            return
+        if result is None:
+            sublime.status_message("GitHub Checks: the log is not available.")
+            return
+
+        text, cut = result
+        lines = [LOG_TIMESTAMP.sub("", line) for line in text.splitlines()]
+        header = "{} - {}/{}@{}".format(check.context, key.owner, key.repo, key.branch)
+        if cut:
+            # the first line is most likely incomplete
+            lines = lines[1:]
+            header += " (last {:d} KB)".format(max_bytes // 1024)
+        sublime.set_timeout(lambda: self.show_panel([header, ""] + lines))
+
+    def show_panel(self, lines):
+        panel = self.window.find_output_panel("GitHub Checks Log")
+        if not panel:
+            panel = self.window.create_output_panel("GitHub Checks Log")
+            preferece = sublime.load_settings("Preferences.sublime-settings")
+            panel.settings().set("color_scheme", preferece.get("color_scheme"))
+            panel.settings().set("syntax", "github-checks-log.sublime-syntax")
+            panel.settings().set("word_wrap", False)
+            panel.set_read_only(True)
+
+        panel.run_command("github_checks_update_panel", {"lines": lines})
+        panel_lines[panel.id()] = lines
+        self.window.run_command("show_panel", {"panel": "output.GitHub Checks Log"})
+        panel.show(panel.size())
+
+
+# lines currently shown in each output panel
+panel_lines = {}
+# (RepoKey, context) of the check on each row of each output panel
+panel_rows = {}
+
+
+class GithubChecksUpdatePanelCommand(sublime_plugin.TextCommand):
+    """
+    Bring the output panel to `lines` in a single edit.  When the number of lines is
+    unchanged, i.e. the same checks are listed, only the lines that differ are rewritten.
+    """
+
+    def run(self, edit, lines):
+        view = self.view
+        previous = panel_lines.get(view.id())
+        text = "\n".join(lines)
+
+        view.set_read_only(False)
+        try:
+            if (not previous or len(previous) != len(lines) or
+                    view.rowcol(view.size())[0] != len(lines) - 1):
+                view.replace(edit, sublime.Region(0, view.size()), text)
+                return
+
+            # bottom up, so that the points of the remaining lines do not move
+            for row in reversed(range(len(lines))):
+                if previous[row] != lines[row]:
+                    region = view.line(view.text_point(row, 0))
+                    view.replace(edit, region, lines[row])
+        finally:
+            view.set_read_only(True)
+
+
+class WindowTriggers:
+    """
+    Collapse the bursts of events of a window, e.g. when a project is opened or tabs are
+    cycled, into at most one update of its active view per `interval` seconds.
+    """
+    interval = 0.5
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # latest view to update by window id
+        self.scheduled = {}
+        self.last_run = {}
+
+    def unchanged(self, window, view):
+        """
+        Whether `view` belongs to the repo and branch the window was focused on last,
+        which were resolved recently enough that a fetch would be on cooldown anyway.
+        """
+        key = view_repos.get(view.id())
+        focused = focused_repos.get(window.id())
+        if not key or not focused or focused[0] != key:
+            return False
+        return time.time() - focused[1] < settings().get("cooldown", 60)
+
+    def trigger(self, view, activated=False):
+        window = view.window() if view else None
+        if not window:
+            return
+        window_id = window.id()
+        with self.lock:
+            if window_id in self.scheduled:
+                # a later view of the same burst replaces the earlier one
+                self.scheduled[window_id] = view
+                return
+            if activated and self.unchanged(window, view):
+                return
+            self.scheduled[window_id] = view
+            delay = self.last_run.get(window_id, 0) + self.interval - time.time()
+        sublime.set_timeout_async(lambda: self.run(window_id), max(0, int(delay * 1000)))
+
+    def run(self, window_id):
+        with self.lock:
+            view = self.scheduled.pop(window_id, None)
+            self.last_run[window_id] = time.time()
+
+        window = view.window() if view else None
         if not window:
             return
 
         window.run_command("github_checks_fetch")
         view.run_command("github_checks_render")
 
+
+triggers = WindowTriggers()
+
+
+class GithubChecksHandler(sublime_plugin.EventListener):
+
+    def update_build_status(self, view, activated=False):
+        triggers.trigger(view, activated)
+
     def on_new(self, view):
         self.update_build_status(view)
 
@@ -575,27 +979,30 @@ class GithubChecksHandler(sublime_plugin.EventListener):
         self.update_build_status(view)
 
     def on_activated(self, view):
-        self.update_build_status(view)
+        self.update_build_status(view, activated=True)
+
+    def on_close(self, view):
+        view_repos.pop(view.id(), None)
+        badge = badges.pop(view.id(), None)
+        if badge:
+            badge.stop()
 
     def on_hover(self, view, point, hover_zone):
         if not view.settings().get("github-checks", False):
             return
 
-        window = view.window()
-        if not window:
-            return
-        if window.id() not in builds:
-            return
         if hover_zone != sublime.HOVER_TEXT:
             return
         if view.match_selector(point, "entity.name") == 0:
             return
 
-        build = builds[window.id()]
-        region = view.extract_scope(point)
-        service = view.substr(region)
+        row = view.rowcol(point)[0]
+        key, service = panel_rows.get(view.id(), {}).get(row, (None, None))
+        if key not in builds or service not in builds[key].checks:
+            return
 
-        url = build["checks"][service]["target_url"]
+        region = view.extract_scope(point)
+        url = builds[key].checks[service].target_url
 
         view.add_regions(
             service,
@@ -617,6 +1024,22 @@ class GithubChecksHandler(sublime_plugin.EventListener):
             on_navigate=on_navigate, on_hide=on_hide)
 
 
+def plugin_loaded():
+    start_webhook_receiver()
+    # show the cached checks of the active views right away
+    for window in sublime.windows():
+        view = window.active_view()
+        if view:
+            GithubChecksHandler().update_build_status(view)
+
+
 def plugin_unloaded():
     for badge in badges.values():
         badge.erase()
+    if _background_loop:
+        _background_loop.close()
+    if _webhook_receiver:
+        _webhook_receiver.close()
+    if _settings:
+        _settings.clear_on_change("github_checks")
+    interwebs.pool.close_all()
@@ -1,9 +1,20 @@
 import re
-from collections import namedtuple
-from . import interwebs
+import json
+import threading
+from base64 import b64encode
+from collections import namedtuple, OrderedDict
+from datetime import datetime
+from urllib.parse import urlparse
+from . import interwebs, telemetry
+from .ratelimit import RateLimitExceeded, get_budget
 
 
 GitHubRepo = namedtuple("GitHubRepo", ("url", "fqdn", "owner", "repo"))
+ApiHost = namedtuple("ApiHost", ("host", "port", "https", "base_path"))
+
+# api urls overriding the default ones by fqdn, e.g. to run against a local stand-in
+# {"github.com": "http://127.0.0.1:8000"}
+api_urls = {}
 
 
 def parse_remote_url(remote_url):
@@ -26,14 +37,318 @@ def parse_remote_url(remote_url):
     return GitHubRepo(remote_url, *match.groups())
 
 
-def query_github(path, github_repo, token=None, headers=None):
+def check_state(status, conclusion):
+    """
+    The state of a check run or workflow job from its `status` and `conclusion`.
+    """
+    if status != "completed":
+        return "pending"
+    if conclusion in ("success", "failure", "neutral", "skipped"):
+        return conclusion
+    return "error"
+
+
+def check_time(*times):
+    """
+    The first known of `times`, or else the current time, as the `created_at` of a
+    check.  A queued check run has not started yet; falling back to the time of its
+    suite, or to when the check was first seen, keeps it from changing with every poll.
+    """
+    for time in times:
+        if time:
+            return time
+    return datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class ResponseCache:
+    """
+    Last successful response per (host, path, token), along with the validators needed
+    to revalidate it with a conditional request.
+
+    Every page of a paginated listing is an entry of its own, and a page of a hundred
+    jobs may well take a hundred KB, so the cache is bounded by the `size` of its
+    entries, i.e. the decoded bodies, rather than by their number.  The parsed payloads
+    take a few times as much memory.
+    """
+
+    max_bytes = 16 * 1024 * 1024
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.size = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if not entry:
+                return None
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, response, size):
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[1]
+            self.entries[key] = (response, size)
+            self.size += size
+            while self.size > self.max_bytes and self.entries:
+                self.size -= self.entries.popitem(last=False)[1][1]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+cache = ResponseCache()
+
+
+def api_host(github_repo):
+    if github_repo.fqdn in api_urls:
+        parsed = urlparse(api_urls[github_repo.fqdn])
+        https = parsed.scheme == "https"
+        return ApiHost(
+            parsed.hostname, parsed.port or (443 if https else 80), https,
+            parsed.path.rstrip("/"))
+
     is_enterprise = not github_repo.fqdn.endswith("github.com")
 
     api_url = "api.github.com" if not is_enterprise else github_repo.fqdn
     base_path = "/api/v3" if is_enterprise else ""
-    path = base_path + path
-    auth = (token, "x-oauth-basic") if token else None
+    return ApiHost(api_url, 443, True, base_path)
+
+
+class RepoContext(namedtuple("RepoContext", (
+        "fqdn", "owner", "repo", "api", "token", "headers"))):
+    """
+    Everything needed to query the api about a repo, resolved once: the ApiHost, the
+    token and the headers sent along with every request, i.e. the authorization.
+    """
 
-    response = interwebs.get(api_url, 443, path, https=True, auth=auth, headers=headers)
+    @classmethod
+    def resolve(cls, github_repo, token=None):
+        headers = {}
+        if token:
+            credentials = "{}:x-oauth-basic".format(token).encode("ascii")
+            headers["Authorization"] = "Basic {}".format(
+                b64encode(credentials).decode("ascii"))
+        return cls(
+            github_repo.fqdn, github_repo.owner, github_repo.repo, api_host(github_repo),
+            token, headers)
+
+
+def rate_limit_budget(context, resource="core"):
+    return get_budget(context.api.host, context.token, resource)
+
+
+def _check_budget(budget):
+    wait = budget.wait_time()
+    if wait:
+        raise RateLimitExceeded(wait)
+
+
+def _update_budget(budget, response):
+    budget.update(response.headers, response.status, response.payload)
+    if response.status in (403, 429):
+        _check_budget(budget)
+
+
+def query_github(path, context, headers=None):
+    api = context.api
+    path = api.base_path + path
+
+    headers = dict(context.headers, **(headers or {}))
+    key = (api.host, path, context.token)
+    cached = cache.get(key)
+    if cached:
+        etag = interwebs.get_header(cached.headers, "ETag")
+        last_modified = interwebs.get_header(cached.headers, "Last-Modified")
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+
+    budget = get_budget(api.host, context.token)
+    _check_budget(budget)
+
+    stats = {}
+    try:
+        response = interwebs.get(
+            api.host, api.port, path, https=api.https, headers=headers, stats=stats)
+    except interwebs.REQUEST_ERRORS as e:
+        telemetry.record_failure(
+            api.host, path[len(api.base_path):], context.owner + "/" + context.repo, stats, e)
+        raise
+
+    telemetry.record(
+        api.host, path[len(api.base_path):], context.owner + "/" + context.repo,
+        response.status, stats, not_modified=response.status == 304 and bool(cached),
+        rate_limit_remaining=interwebs.get_header(response.headers, "X-RateLimit-Remaining"))
+
+    _update_budget(budget, response)
+
+    if response.status == 304 and cached:
+        # 304s do not count against the rate limit; serve the cached payload but keep
+        # the fresh headers so that callers see the current rate limit state
+        response_headers = dict(cached.headers)
+        response_headers.update(response.headers)
+        return cached._replace(headers=response_headers)
+
+    if response.status == 200 and (
+            interwebs.get_header(response.headers, "ETag") or
+            interwebs.get_header(response.headers, "Last-Modified")):
+        cache.put(key, response, stats.get("decoded_bytes", 0))
 
     return response
+
+
+def query_graphql(query, variables, context):
+    """
+    POST a GraphQL query to github.com's /graphql or GHE's /api/graphql endpoint.
+    """
+    api = context.api
+    if api.base_path.endswith("/v3"):
+        path = api.base_path[:-len("/v3")] + "/graphql"
+    else:
+        path = api.base_path + "/graphql"
+    headers = {
+        "Authorization": "bearer {}".format(context.token),
+        "Content-Type": "application/json"
+    }
+    payload = json.dumps({"query": query, "variables": variables}).encode("utf-8")
+
+    budget = get_budget(api.host, context.token, "graphql")
+    _check_budget(budget)
+
+    stats = {}
+    try:
+        response = interwebs.post(
+            api.host, api.port, path, payload=payload, https=api.https, headers=headers,
+            stats=stats)
+    except interwebs.REQUEST_ERRORS as e:
+        telemetry.record_failure(
+            api.host, "/graphql", context.owner + "/" + context.repo, stats, e)
+        raise
+
+    telemetry.record(
+        api.host, "/graphql", context.owner + "/" + context.repo, response.status,
+        stats, rate_limit_remaining=interwebs.get_header(
+            response.headers, "X-RateLimit-Remaining"))
+
+    _update_budget(budget, response)
+
+    return response
+
+
+LINK_NEXT = re.compile(r'<([^>]*)>\s*;\s*rel="next"')
+
+
+def next_page_path(response, context):
+    """
+    The path of the next page given by the Link header, relative to the api base.
+    """
+    link = interwebs.get_header(response.headers, "Link")
+    match = LINK_NEXT.search(link) if link else None
+    if not match:
+        return None
+
+    base_path = context.api.base_path
+    parsed = urlparse(match.group(1))
+    path = parsed.path + ("?" + parsed.query if parsed.query else "")
+    if base_path and path.startswith(base_path):
+        path = path[len(base_path):]
+    return path
+
+
+def query_github_paginated(path, context, headers=None, key=None, max_pages=10,
+                           complete=False):
+    """
+    Follow the Link headers of a list endpoint and return the response of the first page,
+    with the `key` items of the following pages appended to its payload.  The pages are
+    requested back to back over the same pooled connection.  If a following page fails,
+    its response is returned instead, rather than a listing which is silently cut short.
+    If `complete`, None is returned without requesting the following pages when the
+    `total_count` of the first page shows that they cannot hold every item.
+    """
+    response = query_github(path, context, headers=headers)
+    if response.status != 200 or not response.is_json:
+        return response
+
+    items = list(response.payload[key])
+    if complete and response.payload.get("total_count", 0) > len(items) * max_pages:
+        return None
+    page = response
+    for _ in range(max_pages - 1):
+        path = next_page_path(page, context)
+        if not path:
+            break
+        page = query_github(path, context, headers=headers)
+        if page.status != 200 or not page.is_json:
+            return page
+        items.extend(page.payload[key])
+
+    # the payload may be shared with the response cache, do not modify it in place
+    payload = dict(response.payload)
+    payload[key] = items
+    return response._replace(payload=payload)
+
+
+class LogCache(ResponseCache):
+    """
+    Tails of the logs of completed jobs, which do not change anymore, by (host, job id).
+    """
+
+    max_bytes = 2 * 1024 * 1024
+
+
+log_cache = LogCache()
+
+
+def query_job_log(job_id, context, max_bytes=65536):
+    """
+    The last `max_bytes` of the log of a GitHub Actions job as a (text, cut) pair, or
+    None if it is not available (yet).  The api redirects to a short-lived download url
+    which is requested without the token.
+    """
+    api = context.api
+    key = (api.host, job_id, max_bytes)
+    cached = log_cache.get(key)
+    if cached:
+        return cached
+
+    path = "/repos/{}/{}/actions/jobs/{}/logs".format(context.owner, context.repo, job_id)
+    url = "{}://{}:{:d}{}{}".format(
+        "https" if api.https else "http", api.host, api.port, api.base_path, path)
+
+    budget = get_budget(api.host, context.token)
+    _check_budget(budget)
+
+    stats = {}
+    try:
+        response, cut = interwebs.request_tail(
+            url, max_bytes, headers=context.headers, stats=stats)
+    except interwebs.REQUEST_ERRORS as e:
+        telemetry.record_failure(api.host, path, context.owner + "/" + context.repo, stats, e)
+        raise
+
+    telemetry.record(
+        api.host, path, context.owner + "/" + context.repo, response.status, stats,
+        rate_limit_remaining=interwebs.get_header(response.headers, "X-RateLimit-Remaining"))
+
+    _update_budget(budget, response)
+
+    if response.status in (301, 302, 307):
+        location = interwebs.get_header(response.headers, "Location")
+        response, cut = interwebs.request_tail(location, max_bytes)
+
+    if response.status == 416:
+        # the log is empty
+        result = ("", False)
+    elif response.status in (200, 206):
+        result = (response.payload.decode("utf-8", errors="replace"), cut)
+    else:
+        return None
+
+    log_cache.put(key, result, len(result[0]))
+    return result
@@ -26,6 +26,11 @@ THE SOFTWARE.
 
 import http.client
 import json
+import random
+import socket
+import threading
+import time
+import zlib
 from urllib.parse import urlparse
 from base64 import b64encode
 from functools import partial
@@ -34,64 +39,297 @@ from collections import namedtuple
 Response = namedtuple("Response", ("payload", "headers", "status", "is_json"))
 
 
+class ConnectionPool:
+    """
+    Keep-alive connections, grouped by (https, host, port).  A connection is checked out
+    by exactly one thread at a time and returned to the pool once its response has been
+    fully read and the server did not ask to close it.
+
+    New connections are opened with `connect_timeout`, after which every read of the
+    socket waits at most `read_timeout` seconds, so a stalled host cannot hang a thread.
+    """
+
+    max_idle = 4
+    idle_timeout = 60
+    connect_timeout = 10
+    read_timeout = 30
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.idle = {}
+
+    def acquire(self, host, port, https=False):
+        key = (https, host, port)
+        now = time.time()
+        with self.lock:
+            connections = self.idle.get(key, [])
+            while connections:
+                connection, last_used = connections.pop()
+                if now - last_used < self.idle_timeout:
+                    return connection, True
+                connection.close()
+
+        connection = (http.client.HTTPSConnection(host, port, timeout=self.connect_timeout)
+                      if https
+                      else http.client.HTTPConnection(host, port, timeout=self.connect_timeout))
+        connection.connect()
+        connection.sock.settimeout(self.read_timeout)
+        return connection, False
+
+    def release(self, connection, host, port, https=False):
+        key = (https, host, port)
+        with self.lock:
+            connections = self.idle.setdefault(key, [])
+            if len(connections) < self.max_idle:
+                connections.append((connection, time.time()))
+                return
+        connection.close()
+
+    def close_all(self):
+        with self.lock:
+            idle = self.idle
+            self.idle = {}
+        for connections in idle.values():
+            for connection, _ in connections:
+                connection.close()
+
+
+pool = ConnectionPool()
+
+# what a request may raise on a network failure or a garbled response
+REQUEST_ERRORS = (OSError, http.client.HTTPException, ValueError, zlib.error)
+
+# idempotent requests are retried on these statuses and on network errors
+RETRY_STATUSES = (502, 503, 504)
+max_retries = 2
+retry_delay = 0.5
+
+
+def get_header(headers, name, default=None):
+    """
+    Case-insensitive lookup in a response header dict.
+    """
+    name = name.lower()
+    for key, value in headers.items():
+        if key.lower() == name:
+            return value
+    return default
+
+
+def _read(response, chunk_size=65536):
+    """
+    Read the response body, decompressing a gzip or deflate encoded one chunk by chunk.
+    Return the body and the number of bytes received.
+    """
+    encoding = (response.getheader("Content-Encoding") or "").lower()
+    if encoding in ("gzip", "x-gzip"):
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif encoding == "deflate":
+        decompressor = zlib.decompressobj()
+    else:
+        body = response.read()
+        return body, len(body)
+
+    chunks = []
+    received = 0
+    while True:
+        chunk = response.read(chunk_size)
+        if not chunk:
+            break
+        try:
+            chunks.append(decompressor.decompress(chunk))
+        except zlib.error:
+            if encoding != "deflate" or received:
+                raise
+            # some servers send raw deflate data without the zlib header
+            decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            chunks.append(decompressor.decompress(chunk))
+        received += len(chunk)
+    chunks.append(decompressor.flush())
+    return b"".join(chunks), received
+
+
+def _read_tail(response, max_bytes, chunk_size=65536):
+    """
+    Read the response body chunk by chunk, keeping only its last `max_bytes`.  Return
+    the tail and the number of bytes received.
+    """
+    tail = bytearray()
+    received = 0
+    while True:
+        chunk = response.read(chunk_size)
+        if not chunk:
+            break
+        received += len(chunk)
+        tail += chunk
+        if len(tail) > max_bytes:
+            del tail[:len(tail) - max_bytes]
+    return bytes(tail), received
+
+
+def _send(verb, host, port, path, payload, https, headers, read=_read):
+    """
+    Send a request over a pooled connection.  A reused connection may have been closed
+    by the server while it was idle; in that case the request is retried once on a
+    fresh connection.  A timeout is not retried here.
+    """
+    while True:
+        connection, reused = pool.acquire(host, port, https=https)
+        try:
+            connection.request(verb, path, body=payload, headers=headers)
+            response = connection.getresponse()
+            response_payload, received = read(response)
+        except (http.client.HTTPException, OSError) as e:
+            connection.close()
+            if reused and not isinstance(e, socket.timeout):
+                continue
+            raise
+
+        if response.will_close:
+            connection.close()
+        else:
+            pool.release(connection, host, port, https=https)
+
+        return response, response_payload, reused, received
+
+
+def _send_with_retry(verb, host, port, path, payload, https, headers, stats=None):
+    """
+    `_send`, retrying a GET up to `max_retries` times on a network error or a
+    RETRY_STATUSES response.  The delay doubles with every attempt and is jittered, so
+    that the requests of several threads do not hit a recovering host at once.  The
+    number of retries is counted in `stats`.
+    """
+    attempt = 0
+    while True:
+        if stats is not None:
+            stats["retries"] = attempt
+        retry = verb == "GET" and attempt < max_retries
+        try:
+            result = _send(verb, host, port, path, payload, https, headers)
+        except socket.gaierror:
+            # an unknown host, or no network at all
+            raise
+        except (http.client.HTTPException, OSError):
+            if not retry:
+                raise
+        else:
+            if not retry or result[0].status not in RETRY_STATUSES:
+                return result
+        time.sleep(retry_delay * 2 ** attempt * random.uniform(0.5, 1.5))
+        attempt += 1
+
+
 def request(verb, host, port, path, payload=None, https=False, headers=None, auth=None,
-            redirect=True):
+            redirect=True, stats=None):
     """
     Make an HTTP(S) request with the provided HTTP verb, host FQDN, port number, path,
     payload, protocol, headers, and auth information.  Return a response object with
-    payload, headers, JSON flag, and HTTP status number.
+    payload, headers, JSON flag, and HTTP status number.  If a `stats` dict is given, it
+    is filled with the latency, the number of bytes received, whether a pooled
+    connection was reused and the number of retries; the latency and the retries also
+    when the request fails.  A GET is retried on network errors and 502, 503 and 504
+    responses.
     """
     if not headers:
         headers = {}
     headers["User-Agent"] = "GitHubBuildStatus Sublime Plug-in"
+    headers.setdefault("Accept-Encoding", "gzip, deflate")
 
     if auth:
         # use basic authentication
         username_password = "{}:{}".format(*auth).encode("ascii")
         headers["Authorization"] = "Basic {}".format(b64encode(username_password).decode("ascii"))
 
-    connection = (http.client.HTTPSConnection(host, port)
-                  if https
-                  else http.client.HTTPConnection(host, port))
-    connection.request(verb, path, body=payload, headers=headers)
-
-    response = connection.getresponse()
-    response_payload = response.read()
+    start = time.time()
+    try:
+        response, response_payload, reused, received = _send_with_retry(
+            verb, host, port, path, payload, https, headers, stats)
+    finally:
+        if stats is not None:
+            stats["latency"] = time.time() - start
     response_headers = dict(response.getheaders())
     status = response.status
 
-    is_json = "application/json" in response_headers["Content-Type"]
+    if stats is not None:
+        stats["bytes"] = received
+        stats["decoded_bytes"] = len(response_payload)
+        stats["reused"] = reused
+
+    is_json = "application/json" in response_headers.get("Content-Type", "")
     if is_json:
         response_payload = json.loads(response_payload.decode("utf-8"))
 
-    response.close()
-    connection.close()
-
     if redirect and verb == "GET" and status == 301 or status == 302:
         return request_url(
             verb,
             response_headers["Location"],
             headers=headers,
-            auth=auth
+            auth=auth,
+            stats=stats
         )
 
     return Response(response_payload, response_headers, status, is_json)
 
 
-def request_url(verb, url, payload=None, headers=None, auth=None):
+def request_tail(url, max_bytes, headers=None, auth=None, stats=None):
+    """
+    GET the last `max_bytes` of the body of `url`, using a Range request.  If the
+    server ignores the range, the body is streamed and only its tail is kept, so a
+    large body is never held in memory.  Redirects are not followed.  Return the
+    response, with the tail as payload, and whether the body was cut.
+    """
+    parsed = urlparse(url)
+    https = parsed.scheme == "https"
+    path = parsed.path + ("?" + parsed.query if parsed.query else "")
+
+    headers = dict(headers) if headers else {}
+    headers["User-Agent"] = "GitHubBuildStatus Sublime Plug-in"
+    # ranges apply to the encoded body
+    headers["Accept-Encoding"] = "identity"
+    headers["Range"] = "bytes=-{:d}".format(max_bytes)
+    if auth:
+        username_password = "{}:{}".format(*auth).encode("ascii")
+        headers["Authorization"] = "Basic {}".format(b64encode(username_password).decode("ascii"))
+
+    start = time.time()
+    try:
+        response, tail, reused, received = _send(
+            "GET", parsed.hostname, parsed.port or (443 if https else 80), path, None, https,
+            headers, read=partial(_read_tail, max_bytes=max_bytes))
+    finally:
+        if stats is not None:
+            stats["latency"] = time.time() - start
+    response_headers = dict(response.getheaders())
+
+    if stats is not None:
+        stats["bytes"] = received
+        stats["decoded_bytes"] = len(tail)
+        stats["reused"] = reused
+
+    if response.status == 206:
+        content_range = get_header(response_headers, "Content-Range", "")
+        cut = not content_range.startswith("bytes 0-")
+    else:
+        cut = received > len(tail)
+    return Response(tail, response_headers, response.status, False), cut
+
+
+def request_url(verb, url, payload=None, headers=None, auth=None, stats=None):
     parsed = urlparse(url)
     https = parsed.scheme == "https"
     return request(
         verb,
         parsed.hostname,
-        parsed.port or 443 if https else 80,
-        parsed.path,
+        parsed.port or (443 if https else 80),
+        parsed.path + ("?" + parsed.query if parsed.query else ""),
         payload=payload,
         https=https,
         headers=headers,
         auth=([parsed.username, parsed.password]
               if parsed.username and parsed.password
-              else None)
+              else None),
+        stats=stats
     )
 
 
@@ -0,0 +1,130 @@
+import threading
+import time
+
+from .interwebs import get_header
+
+
+class RateLimitExceeded(Exception):
+    def __init__(self, wait):
+        super().__init__("rate limit exceeded, retry in {:d} seconds".format(int(wait)))
+        self.wait = wait
+
+
+def is_secondary_rate_limit(payload):
+    """
+    Whether the body of a 403 response tells about a secondary rate limit rather than,
+    e.g., missing permissions.
+    """
+    if isinstance(payload, dict):
+        message = payload.get("message") or ""
+    elif isinstance(payload, bytes):
+        message = payload.decode("utf-8", errors="replace")
+    else:
+        message = payload or ""
+    message = message.lower()
+    return "secondary rate limit" in message or "abuse detection" in message
+
+
+class RateLimitBudget:
+    """
+    Rate limit state of a (host, token) pair, as last reported by the X-RateLimit-* and
+    Retry-After response headers.  It is shared by every window polling with the same
+    token.
+    """
+
+    min_backoff = 60
+    max_backoff = 900
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.limit = None
+        self.remaining = None
+        self.reset = None
+        self.blocked_until = 0
+        self.backoff = 0
+
+    def update(self, headers, status, payload=None):
+        """
+        Take in the headers of a response.  A 403 only counts as rate limiting if the
+        budget is used up, a Retry-After is given or `payload` says so; any other 403,
+        e.g. for a token lacking a permission, is left to the caller.
+        """
+        now = time.time()
+        limit = get_header(headers, "X-RateLimit-Limit")
+        remaining = get_header(headers, "X-RateLimit-Remaining")
+        reset = get_header(headers, "X-RateLimit-Reset")
+        retry_after = get_header(headers, "Retry-After")
+
+        with self.lock:
+            try:
+                if limit is not None:
+                    self.limit = int(limit)
+                if remaining is not None:
+                    self.remaining = int(remaining)
+                if reset is not None:
+                    self.reset = int(reset)
+            except ValueError:
+                pass
+
+            if status not in (403, 429):
+                self.backoff = 0
+                return
+
+            if retry_after is not None and retry_after.isdigit():
+                # secondary rate limit
+                self.blocked_until = now + int(retry_after)
+            elif remaining is not None and self.remaining == 0 and self.reset:
+                self.blocked_until = self.reset
+            elif status == 429 or is_secondary_rate_limit(payload):
+                # secondary rate limit without an explicit hint, back off exponentially
+                self.backoff = min(max(self.backoff * 2, self.min_backoff), self.max_backoff)
+                self.blocked_until = now + self.backoff
+
+    def wait_time(self):
+        """
+        Number of seconds to wait before the next request is allowed.
+        """
+        now = time.time()
+        with self.lock:
+            if self.blocked_until > now:
+                return self.blocked_until - now
+            if self.remaining == 0 and self.reset and self.reset > now:
+                return self.reset - now
+        return 0
+
+    def refresh_interval(self, refresh):
+        """
+        Stretch the refresh interval once less than half of the budget is left, so that
+        the remaining requests are spread until the budget resets.
+        """
+        wait = self.wait_time()
+        if wait:
+            return max(refresh, wait)
+
+        now = time.time()
+        with self.lock:
+            if not self.limit or self.remaining is None:
+                return refresh
+            fraction = self.remaining / self.limit
+            if fraction >= 0.5:
+                return refresh
+            interval = refresh * 0.5 / max(fraction, 0.01)
+            if self.reset and self.reset > now:
+                interval = min(interval, self.reset - now)
+        return max(refresh, interval)
+
+
+_budgets = {}
+_budgets_lock = threading.Lock()
+
+
+def get_budget(host, token=None, resource="core"):
+    """
+    The budget of a (host, token) pair.  GitHub accounts the REST ("core") and GraphQL
+    ("graphql") APIs separately.
+    """
+    key = (host, token, resource)
+    with _budgets_lock:
+        if key not in _budgets:
+            _budgets[key] = RateLimitBudget()
+        return _budgets[key]
@@ -0,0 +1,137 @@
+"""
+A bounded in-memory log of the api requests, and the summaries shown by the
+"GitHub Checks: Diagnostics" command.
+"""
+
+import re
+import threading
+import time
+from collections import deque, namedtuple, OrderedDict
+
+
+# a request which failed without a response has status 0 and the name of the exception
+# as `error`
+Record = namedtuple("Record", (
+    "time", "host", "endpoint", "repo", "status", "latency", "bytes", "reused",
+    "not_modified", "rate_limit_remaining", "retries", "error"))
+
+max_records = 2000
+
+_lock = threading.Lock()
+_records = deque(maxlen=max_records)
+
+
+ENDPOINT_PATTERNS = [
+    (re.compile(r"^/repos/([^/]+/[^/]+)"), "/repos/:owner/:repo"),
+    (re.compile(r"/branches/.+$"), "/branches/:branch"),
+    (re.compile(r"/[0-9a-f]{40}(?=/|$)"), "/:sha"),
+    (re.compile(r"/\d+(?=/|$)"), "/:id"),
+]
+
+
+def endpoint(path):
+    """
+    Turn a request path into its endpoint, e.g. /repos/:owner/:repo/actions/runs/:id/jobs.
+    """
+    path = path.split("?", 1)[0]
+    for pattern, replacement in ENDPOINT_PATTERNS:
+        path = pattern.sub(replacement, path)
+    return path
+
+
+def record(host, path, repo, status, stats, not_modified=False, rate_limit_remaining=None,
+           error=None):
+    with _lock:
+        _records.append(Record(
+            time.time(), host, endpoint(path), repo, status, stats.get("latency", 0),
+            stats.get("bytes", 0), stats.get("reused", False), not_modified,
+            rate_limit_remaining, stats.get("retries", 0), error))
+
+
+def record_failure(host, path, repo, stats, error):
+    record(host, path, repo, 0, stats, error=type(error).__name__)
+
+
+def records():
+    with _lock:
+        return list(_records)
+
+
+def clear():
+    with _lock:
+        _records.clear()
+
+
+def percentile(values, p):
+    if not values:
+        return 0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def summarize(records, key):
+    groups = OrderedDict()
+    for r in sorted(records, key=key):
+        groups.setdefault(key(r), []).append(r)
+
+    rows = []
+    for name, group in groups.items():
+        latencies = [r.latency * 1000 for r in group]
+        rows.append(OrderedDict([
+            ("name", name),
+            ("requests", len(group)),
+            ("errors", sum(r.status >= 400 or bool(r.error) for r in group)),
+            ("retries", sum(r.retries for r in group)),
+            ("304", sum(r.not_modified for r in group)),
+            ("reused", sum(r.reused for r in group)),
+            ("kbytes", round(sum(r.bytes for r in group) / 1024, 1)),
+            ("p50 ms", round(percentile(latencies, 50))),
+            ("p90 ms", round(percentile(latencies, 90))),
+            ("p99 ms", round(percentile(latencies, 99))),
+        ]))
+    return rows
+
+
+def format_table(title, rows):
+    if not rows:
+        return title + "\n  no requests\n"
+    columns = list(rows[0].keys())
+    widths = [max(len(str(c)), *(len(str(row[c])) for row in rows)) for c in columns]
+    lines = [title]
+    lines.append("  " + "  ".join(
+        str(c).ljust(w) if i == 0 else str(c).rjust(w)
+        for i, (c, w) in enumerate(zip(columns, widths))))
+    for row in rows:
+        lines.append("  " + "  ".join(
+            str(row[c]).ljust(w) if i == 0 else str(row[c]).rjust(w)
+            for i, (c, w) in enumerate(zip(columns, widths))))
+    return "\n".join(lines) + "\n"
+
+
+def report():
+    rs = records()
+    text = "GitHub Checks Diagnostics ({:d} requests recorded, last {:d} kept)\n\n".format(
+        len(rs), max_records)
+    text += format_table("By endpoint", summarize(rs, lambda r: r.endpoint)) + "\n"
+    text += format_table("By repo", summarize(rs, lambda r: r.repo)) + "\n"
+
+    failures = OrderedDict()
+    for r in rs:
+        if r.error:
+            failures[r.error] = failures.get(r.error, 0) + 1
+    text += "Failed requests\n"
+    for error, count in failures.items():
+        text += "  {}  {:d}\n".format(error, count)
+    if not failures:
+        text += "  none\n"
+    text += "\n"
+
+    remaining = OrderedDict()
+    for r in rs:
+        if r.rate_limit_remaining is not None:
+            remaining[r.host] = r.rate_limit_remaining
+    text += "Rate limit remaining\n"
+    for host, value in remaining.items():
+        text += "  {}  {}\n".format(host, value)
+    return text
@@ -0,0 +1,197 @@
+"""
+A small local HTTP listener for GitHub webhook deliveries, e.g. forwarded by a relay,
+and the conversion of the `check_run`, `check_suite`, `workflow_job` and `status`
+payloads into updates of the checks of a commit.
+
+    curl -X POST -H "X-GitHub-Event: status" -d @payload.json http://127.0.0.1:<port>/
+"""
+
+import hashlib
+import hmac
+import json
+import threading
+import time
+from collections import namedtuple
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import urlparse
+
+from .github import check_state
+
+
+# `checks` are added to or replace the checks of `sha`, the contexts in `removed` are
+# dropped; `branches` are the branches the commit was pushed to, if known
+Update = namedtuple("Update", (
+    "fqdn", "owner", "repo", "sha", "branches", "checks", "removed"))
+
+EVENTS = ("check_run", "check_suite", "workflow_job", "status")
+
+
+def commit_checks_url(fqdn, owner, repo, sha):
+    return "https://{}/{}/{}/commit/{}/checks".format(fqdn, owner, repo, sha)
+
+
+def parse_event(event, payload):
+    """
+    Turn a webhook delivery into an Update, or None if it does not concern any check.
+    The checks are named like the ones fetched through the api.  The `created_at` of a
+    check is None if the payload does not tell.
+    """
+    repository = payload.get("repository")
+    if event not in EVENTS or not repository:
+        return None
+    fqdn = urlparse(repository["html_url"]).netloc
+    owner, repo = repository["full_name"].split("/", 1)
+    checks = {}
+    removed = []
+
+    if event == "status":
+        sha = payload["sha"]
+        branches = tuple(branch["name"] for branch in payload.get("branches", []))
+        checks[payload["context"]] = {
+            "state": payload["state"],
+            "context": payload["context"],
+            "description": payload["description"],
+            "target_url": payload["target_url"],
+            "created_at": payload["created_at"],
+            "updated_at": payload["updated_at"]
+        }
+
+    elif event == "workflow_job":
+        job = payload["workflow_job"]
+        if not job.get("workflow_name"):
+            # older GHE versions do not tell the name of the workflow
+            return None
+        sha = job["head_sha"]
+        branches = (job["head_branch"],) if job.get("head_branch") else ()
+        context = job["workflow_name"] + " / " + job["name"]
+        state = check_state(job["status"], job["conclusion"])
+        # older GHE versions do not tell when a queued job was created either
+        created_at = job.get("created_at") or job["started_at"]
+        checks[context] = {
+            "state": state,
+            "context": context,
+            "description": state,
+            "target_url": job["html_url"],
+            "created_at": created_at,
+            "updated_at": job["completed_at"] or job["started_at"] or created_at,
+            "job_id": job["id"]
+        }
+
+    elif event == "check_run":
+        check_run = payload["check_run"]
+        if check_run["app"]["slug"] == "github-actions":
+            # delivered as workflow_job too, along with the name of the workflow
+            return None
+        sha = check_run["head_sha"]
+        head_branch = check_run["check_suite"].get("head_branch")
+        branches = (head_branch,) if head_branch else ()
+        context = check_run["name"]
+        state = check_state(check_run["status"], check_run["conclusion"])
+        created_at = check_run["started_at"] or check_run["check_suite"].get("created_at")
+        checks[context] = {
+            "state": state,
+            "context": context,
+            "description": (check_run.get("output") or {}).get("title") or state,
+            "target_url": check_run["html_url"],
+            "created_at": created_at,
+            "updated_at": check_run["completed_at"] or created_at
+        }
+
+    else:
+        suite = payload["check_suite"]
+        if suite["app"]["slug"] == "github-actions":
+            return None
+        sha = suite["head_sha"]
+        branches = (suite["head_branch"],) if suite.get("head_branch") else ()
+        context = suite["app"]["name"]
+        if suite["status"] == "completed" or suite.get("latest_check_runs_count"):
+            # the placeholder is superseded by the check runs of the suite
+            removed.append(context)
+        else:
+            checks[context] = {
+                "state": "pending",
+                "context": context,
+                "description": suite["status"],
+                "target_url": commit_checks_url(fqdn, owner, repo, sha),
+                "created_at": suite["created_at"],
+                "updated_at": suite["updated_at"]
+            }
+
+    return Update(fqdn, owner, repo, sha, branches, checks, removed)
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        receiver = self.server.receiver
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+
+        if receiver.secret:
+            digest = hmac.new(receiver.secret.encode("utf-8"), body, hashlib.sha256)
+            signature = self.headers.get("X-Hub-Signature-256", "")
+            if not hmac.compare_digest("sha256=" + digest.hexdigest(), signature):
+                return self.reply(401)
+
+        event = self.headers.get("X-GitHub-Event", "")
+        try:
+            payload = json.loads(body.decode("utf-8"))
+            update = parse_event(event, payload)
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return self.reply(400)
+
+        if update:
+            receiver.received(update)
+        self.reply(202 if update else 204)
+
+    def reply(self, status):
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+class WebhookReceiver:
+    """
+    Listen on `port` of localhost and pass the Update of every delivery to `callback`.
+    Deliveries are handled one at a time, so the callback needs no locking of its own
+    against other deliveries.
+    """
+
+    def __init__(self, port, callback, secret=None, host="127.0.0.1"):
+        self.address = (host, port)
+        self.callback = callback
+        self.secret = secret
+        self.server = None
+        # time of the last delivery by (fqdn, owner, repo)
+        self.last_events = {}
+
+    @property
+    def port(self):
+        return self.server.server_address[1] if self.server else None
+
+    def start(self):
+        self.server = HTTPServer(self.address, _Handler)
+        self.server.receiver = self
+        thread = threading.Thread(target=self.server.serve_forever, name="GitHubChecksWebhooks")
+        thread.daemon = True
+        thread.start()
+
+    def received(self, update):
+        self.last_events[(update.fqdn, update.owner, update.repo)] = time.time()
+        self.callback(update)
+
+    def silence(self, fqdn, owner, repo):
+        """
+        Seconds since the last delivery for the repository, or None if there was none.
+        """
+        last = self.last_events.get((fqdn, owner, repo))
+        return time.time() - last if last else None
+
+    def close(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
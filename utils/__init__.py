@@ -1,2 +1,2 @@
 from . import dates
-from . import badge
+from . import gitrepo
@@ -1,19 +1,63 @@
+import sublime
 import threading
 from collections import defaultdict
 
 
+class Ticker:
+    """
+    Advance the indicator of every pending badge from one timeout loop on Sublime's
+    scheduler.  The loop only runs while there is at least one pending badge.
+    """
+    interval = 100
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.badges = set()
+        self.running = False
+        self.frame = 0
+
+    def add(self, badge):
+        with self.lock:
+            self.badges.add(badge)
+            if self.running:
+                return
+            self.running = True
+        sublime.set_timeout(self.tick, self.interval)
+
+    def remove(self, badge):
+        with self.lock:
+            self.badges.discard(badge)
+
+    def tick(self):
+        with self.lock:
+            self.frame = (self.frame + 1) % len(DynamicBadge.dots)
+            badges = list(self.badges)
+            if not badges:
+                self.running = False
+                return
+
+        for badge in badges:
+            if not badge.view.is_valid():
+                self.remove(badge)
+            elif badge.is_visible():
+                badge.update(self.frame)
+
+        sublime.set_timeout(self.tick, self.interval)
+
+
+ticker = Ticker()
+
+
 class DynamicBadge:
     dots = ["⠋", "⠙", "⠹", "⠸", "⠼", "⠴", "⠦", "⠧", "⠇", "⠏"]
     message = None
-    thread = None
 
     def __init__(self, view, name):
         self.view = view
         self.name = name
 
     def stop(self):
-        if self.thread:
-            self.thread.cancel()
+        ticker.remove(self)
 
     def erase(self):
         self.stop()
@@ -21,8 +65,15 @@ class DynamicBadge:
 
     def set_status(self, message):
         self.message = message
-        self.stop()
-        self.update()
+        self.update(ticker.frame)
+        if "{indicator}" in message:
+            ticker.add(self)
+        else:
+            self.stop()
+
+    def is_visible(self):
+        window = self.view.window()
+        return bool(window) and window.active_view() == self.view
 
     def update(self, status=0):
         if not self.message:
@@ -32,9 +83,5 @@ class DynamicBadge:
             self.name,
             self.message.format_map(defaultdict(str, indicator=self.dots[status])))
 
-        if "{indicator}" in self.message:
-            self.thread = threading.Timer(0.1, lambda: self.update(status+1))
-            self.thread.start()
-
     def __del__(self):
         self.erase()
@@ -0,0 +1,75 @@
+"""
+The last known checks of each branch, persisted as one json file per branch so that
+they can be shown right after a restart.  Files are replaced atomically, so several
+Sublime instances can share the directory; the least recently used files are evicted.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+class BuildCache:
+    max_entries = 200
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, key):
+        digest = hashlib.sha1("\0".join(key).encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, digest + ".json")
+
+    def load(self, key):
+        """
+        Return the (sha, checks) last saved for `key`, or None.
+        """
+        path = self.path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                entry = json.load(f)
+            # mark as recently used
+            os.utime(path, None)
+        except (OSError, ValueError):
+            return None
+        if entry.get("key") != list(key):
+            return None
+        return entry["sha"], entry["checks"]
+
+    def save(self, key, sha, checks):
+        entry = {
+            "key": list(key),
+            "sha": sha,
+            "checks": checks,
+            "saved_at": int(time.time())
+        }
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(key)
+        tmp = "{}.{:d}.{:d}.tmp".format(path, os.getpid(), threading.get_ident())
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+        os.replace(tmp, path)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                entries.append((os.path.getmtime(path), path))
+            except OSError:
+                # removed by another instance in the meantime
+                continue
+
+        if len(entries) <= self.max_entries:
+            return
+
+        entries.sort()
+        for _, path in entries[:len(entries) - self.max_entries]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
@@ -0,0 +1,126 @@
+"""
+The checks of a commit.  A Build keeps the number of checks in each state and a
+fingerprint of its content up to date as checks are merged, so that neither needs a
+scan of the checks.
+
+The states are plain strings as returned by the apis; the enum module is not available
+in the Python 3.3 plugin host of Sublime Text 3.
+"""
+
+
+class State:
+    SUCCESS = "success"
+    FAILURE = "failure"
+    ERROR = "error"
+    NEUTRAL = "neutral"
+    SKIPPED = "skipped"
+    PENDING = "pending"
+
+    ALL = (SUCCESS, FAILURE, ERROR, NEUTRAL, SKIPPED, PENDING)
+
+
+class Check:
+    """
+    A check run, workflow job or commit status of a commit, named by its `context`.
+    `job_id` is the id of the GitHub Actions job, whose log can be fetched.
+    """
+    __slots__ = ("state", "context", "description", "target_url", "created_at", "updated_at",
+                 "job_id")
+
+    def __init__(self, state, context, description=None, target_url=None, created_at=None,
+                 updated_at=None, job_id=None):
+        self.state = state
+        self.context = context
+        self.description = description
+        self.target_url = target_url
+        self.created_at = created_at
+        self.updated_at = updated_at
+        self.job_id = job_id
+
+    @classmethod
+    def from_dict(cls, check):
+        return cls(*(check.get(field) for field in cls.__slots__))
+
+    def as_dict(self):
+        return {field: getattr(self, field) for field in self.__slots__}
+
+    def astuple(self):
+        return tuple(getattr(self, field) for field in self.__slots__)
+
+    def __eq__(self, other):
+        return isinstance(other, Check) and self.astuple() == other.astuple()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.astuple())
+
+    def __repr__(self):
+        return "Check({})".format(", ".join(repr(value) for value in self.astuple()))
+
+
+class Build:
+    """
+    The checks of the commit `sha` by context.  A `stale` build was loaded from the
+    disk cache and is yet to be refreshed.
+
+    A build is shared between threads once it is stored; merge into a `copy()` of it.
+    """
+    __slots__ = ("sha", "checks", "counts", "stale", "_digest")
+
+    def __init__(self, sha, checks=(), stale=False):
+        self.sha = sha
+        self.checks = {}
+        self.counts = dict.fromkeys(State.ALL, 0)
+        self.stale = stale
+        # order independent hash of the checks
+        self._digest = 0
+        self.merge(checks)
+
+    @classmethod
+    def from_dicts(cls, sha, checks, stale=False):
+        return cls(sha, (Check.from_dict(check) for check in checks.values()), stale)
+
+    def as_dicts(self):
+        return {context: check.as_dict() for context, check in self.checks.items()}
+
+    def copy(self):
+        build = Build(self.sha, stale=self.stale)
+        build.checks = dict(self.checks)
+        build.counts = dict(self.counts)
+        build._digest = self._digest
+        return build
+
+    @property
+    def fingerprint(self):
+        """
+        Equal for builds with the same content, which is compared in O(1).
+        """
+        return (self.sha, self.stale, len(self.checks), self._digest)
+
+    def merge(self, checks, removed=()):
+        """
+        Add or replace `checks` and drop the checks named in `removed`.  Return whether
+        anything changed.
+        """
+        changed = False
+        for context in removed:
+            check = self.checks.pop(context, None)
+            if check:
+                self._count(check, -1)
+                changed = True
+        for check in checks:
+            previous = self.checks.get(check.context)
+            if previous == check:
+                continue
+            if previous:
+                self._count(previous, -1)
+            self.checks[check.context] = check
+            self._count(check, 1)
+            changed = True
+        return changed
+
+    def _count(self, check, n):
+        self.counts[check.state] = self.counts.get(check.state, 0) + n
+        self._digest ^= hash(check)
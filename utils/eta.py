@@ -0,0 +1,121 @@
+"""
+Observed check durations and the refresh delay they suggest.  Durations are kept as a
+running average per (repo, check context), persisted as json.
+"""
+
+import calendar
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+def timestamp(time_string):
+    return calendar.timegm(time.strptime(time_string, "%Y-%m-%dT%H:%M:%SZ"))
+
+
+class DurationHistory:
+    max_repos = 100
+    max_contexts = 200
+    # weight of the latest observation in the running average
+    alpha = 0.3
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.repos = None
+        self.dirty = False
+
+    def load(self):
+        if self.repos is not None:
+            return
+        self.repos = OrderedDict()
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                self.repos = json.load(f, object_pairs_hook=OrderedDict)
+        except (OSError, ValueError):
+            pass
+
+    def record(self, repo, checks):
+        """
+        Record the durations of the completed checks of `repo`, Check records by
+        context.  A check is recorded once per run, identified by its created_at timestamp.
+        """
+        with self.lock:
+            self.load()
+            contexts = self.repos.setdefault(repo, OrderedDict())
+            self.repos.move_to_end(repo)
+            for context, check in checks.items():
+                if check.state == "pending":
+                    continue
+                created_at = check.created_at
+                updated_at = check.updated_at
+                if not created_at or not updated_at:
+                    continue
+                entry = contexts.get(context)
+                if entry and entry[2] == created_at:
+                    continue
+                duration = timestamp(updated_at) - timestamp(created_at)
+                if duration <= 0:
+                    continue
+                if entry:
+                    average = (1 - self.alpha) * entry[0] + self.alpha * duration
+                    contexts[context] = [average, entry[1] + 1, created_at]
+                else:
+                    contexts[context] = [duration, 1, created_at]
+                contexts.move_to_end(context)
+                self.dirty = True
+
+            while len(contexts) > self.max_contexts:
+                contexts.popitem(last=False)
+            while len(self.repos) > self.max_repos:
+                self.repos.popitem(last=False)
+
+    def expected_duration(self, repo, context):
+        with self.lock:
+            self.load()
+            entry = self.repos.get(repo, {}).get(context)
+        return entry[0] if entry else None
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            data = json.dumps(self.repos)
+            self.dirty = False
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = "{}.{:d}.{:d}.tmp".format(self.path, os.getpid(), threading.get_ident())
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(tmp, self.path)
+
+    def refresh_delay(self, repo, checks, refresh, now=None):
+        """
+        Seconds until the next poll: sparse while the pending checks are predicted to
+        take a while, dense around their predicted completion, and `refresh` when there
+        is nothing to predict or the prediction has been overrun.
+        """
+        if now is None:
+            now = time.time()
+
+        remaining = None
+        for context, check in checks.items():
+            if check.state != "pending" or not check.created_at:
+                continue
+            expected = self.expected_duration(repo, context)
+            if expected is None:
+                # an unpredictable check, poll at the regular pace
+                return refresh
+            eta = timestamp(check.created_at) + expected - now
+            if eta < -expected / 2:
+                # long overdue, the prediction is of no use
+                return refresh
+            remaining = eta if remaining is None else min(remaining, eta)
+
+        if remaining is None:
+            return refresh
+        if remaining > refresh:
+            # halve the distance to the predicted completion
+            return max(refresh, min(remaining / 2, 10 * refresh))
+        return max(5, refresh / 3)
@@ -0,0 +1,268 @@
+"""
+Read HEAD and config straight from the git directory, so that the common lookups do
+not need to spawn a git process.  Anything this module does not understand (e.g.
+`include` / `includeIf` directives) raises `Unsupported` and the caller is expected to
+fall back to the git binary, except for `NotARepository`, which git would not find a
+repository for either.
+"""
+
+import os
+import re
+import threading
+
+
+class Unsupported(Exception):
+    pass
+
+
+class NotARepository(Unsupported):
+    pass
+
+
+_lock = threading.Lock()
+_cache = {}
+
+
+def _cached(path, parse):
+    """
+    Parse the file at `path`, reusing the previous result as long as its mtime and
+    size are unchanged.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    stamp = (st.st_mtime_ns, st.st_size)
+    with _lock:
+        entry = _cache.get(path)
+        if entry and entry[0] == stamp:
+            value = entry[1]
+            if isinstance(value, Unsupported):
+                raise value
+            return value
+    with open(path, encoding="utf-8", errors="replace") as f:
+        try:
+            value = parse(f.read())
+        except Unsupported as e:
+            # remember the failure too, so that the caller falls back without reparsing
+            value = e
+    with _lock:
+        _cache[path] = (stamp, value)
+    if isinstance(value, Unsupported):
+        raise value
+    return value
+
+
+def _read_gitdir_file(path):
+    content = _cached(path, lambda text: text.strip())
+    if not content or not content.startswith("gitdir:"):
+        raise Unsupported("invalid gitdir file: {}".format(path))
+    gitdir = content[len("gitdir:"):].strip()
+    return os.path.normpath(os.path.join(os.path.dirname(path), gitdir))
+
+
+def find_git_dir(cwd):
+    """
+    Return (worktree, git_dir, common_dir) of the repository containing `cwd`.  Linked
+    worktrees and submodules have a `.git` file pointing to their git directory, which
+    in turn may have a `commondir` file pointing to the shared one.
+    """
+    if not cwd:
+        raise NotARepository("no working directory")
+
+    path = os.path.abspath(cwd)
+    while True:
+        dotgit = os.path.join(path, ".git")
+        if os.path.isdir(dotgit):
+            git_dir = dotgit
+            break
+        elif os.path.isfile(dotgit):
+            git_dir = _read_gitdir_file(dotgit)
+            break
+        parent = os.path.dirname(path)
+        if parent == path:
+            raise NotARepository("not a git repository: {}".format(cwd))
+        path = parent
+
+    common_dir = git_dir
+    commondir_file = os.path.join(git_dir, "commondir")
+    if os.path.isfile(commondir_file):
+        common = _cached(commondir_file, lambda text: text.strip())
+        if common:
+            common_dir = os.path.normpath(os.path.join(git_dir, common))
+
+    return path, git_dir, common_dir
+
+
+def _parse_head(text):
+    text = text.strip()
+    if text.startswith("ref:"):
+        return text[len("ref:"):].strip()
+    return None
+
+
+def head_ref(cwd):
+    """
+    The full ref HEAD points to, or None if HEAD is detached.
+    """
+    _, git_dir, _ = find_git_dir(cwd)
+    head = os.path.join(git_dir, "HEAD")
+    if not os.path.isfile(head):
+        raise Unsupported("HEAD not found")
+    return _cached(head, _parse_head)
+
+
+def head_branch(cwd):
+    """
+    Equivalent of `git symbolic-ref HEAD --short`.
+    """
+    ref = head_ref(cwd)
+    if not ref:
+        return None
+    if ref.startswith("refs/heads/"):
+        return ref[len("refs/heads/"):]
+    return ref
+
+
+SECTION = re.compile(r'^\[\s*([-.\w]+)(?:\s+"((?:[^"\\]|\\.)*)")?\s*\]\s*(.*)$')
+VARIABLE = re.compile(r'^([A-Za-z][-A-Za-z0-9]*)\s*(?:=\s*(.*))?$')
+
+
+def _parse_value(raw):
+    value = []
+    quoted = False
+    i = 0
+    while i < len(raw):
+        c = raw[i]
+        if c == "\\" and i + 1 < len(raw):
+            nxt = raw[i + 1]
+            value.append({"n": "\n", "t": "\t", "b": "\b"}.get(nxt, nxt))
+            i += 2
+            continue
+        elif c == '"':
+            quoted = not quoted
+        elif c in "#;" and not quoted:
+            break
+        else:
+            value.append(c)
+        i += 1
+    return "".join(value).strip()
+
+
+def parse_config(text):
+    """
+    Parse a git config file into a dict of `section.subsection.name` -> value, using
+    the same key normalization as `git config`.  The last value of a multi-valued key
+    wins.
+    """
+    config = {}
+    section = None
+    lines = iter(text.splitlines())
+    for line in lines:
+        while line.endswith("\\") and not line.endswith("\\\\"):
+            line = line[:-1] + next(lines, "")
+        line = line.strip()
+        if not line or line[0] in "#;":
+            continue
+
+        if line.startswith("["):
+            match = SECTION.match(line)
+            if not match:
+                raise Unsupported("cannot parse config line: {}".format(line))
+            name, subsection, rest = match.groups()
+            name = name.lower()
+            if name in ("include", "includeif"):
+                raise Unsupported("config includes are not supported")
+            if subsection is not None:
+                subsection = re.sub(r"\\(.)", r"\1", subsection)
+                section = name + "." + subsection
+            else:
+                # also covers the deprecated [section.subsection] syntax
+                section = name
+            line = rest.strip()
+            if not line or line[0] in "#;":
+                continue
+
+        if section is None:
+            raise Unsupported("config variable outside of a section")
+        match = VARIABLE.match(line)
+        if not match:
+            raise Unsupported("cannot parse config line: {}".format(line))
+        key, raw = match.groups()
+        config[section + "." + key.lower()] = "true" if raw is None else _parse_value(raw)
+
+    return config
+
+
+def _normalize_key(key):
+    parts = key.split(".")
+    if len(parts) < 2:
+        raise Unsupported("invalid config key: {}".format(key))
+    section, name = parts[0].lower(), parts[-1].lower()
+    if len(parts) == 2:
+        return section + "." + name
+    return section + "." + ".".join(parts[1:-1]) + "." + name
+
+
+def config(cwd, key):
+    """
+    Equivalent of `git config <key>` for the repository containing `cwd`, limited to
+    the repository's own config file.
+    """
+    _, git_dir, common_dir = find_git_dir(cwd)
+    path = os.path.join(common_dir, "config")
+    values = _cached(path, parse_config)
+    if values is None:
+        raise Unsupported("config not found")
+    return values.get(_normalize_key(key))
+
+
+# directories that are not worth walking into when looking for repositories
+SKIP_DIRS = {".git", ".hg", ".svn", "node_modules", "__pycache__", ".tox", ".venv", "venv"}
+
+
+def _submodule_paths(worktree):
+    try:
+        modules = _cached(os.path.join(worktree, ".gitmodules"), parse_config)
+    except Unsupported:
+        return []
+    if not modules:
+        return []
+    return [os.path.normpath(os.path.join(worktree, path))
+            for key, path in sorted(modules.items())
+            if key.startswith("submodule.") and key.endswith(".path")]
+
+
+def find_repos(folders, max_depth=3):
+    """
+    Return the worktrees of every repository in `folders`: the repository containing
+    each folder, the repositories (including linked worktrees) up to `max_depth` levels
+    below it, and their checked out submodules.
+    """
+    repos = []
+
+    def add(worktree):
+        if worktree in repos:
+            return
+        repos.append(worktree)
+        for path in _submodule_paths(worktree):
+            if os.path.exists(os.path.join(path, ".git")):
+                add(path)
+
+    for folder in folders:
+        folder = os.path.abspath(folder)
+        try:
+            add(find_git_dir(folder)[0])
+        except (Unsupported, OSError):
+            pass
+
+        depth = folder.rstrip(os.sep).count(os.sep)
+        for root, dirs, files in os.walk(folder):
+            if ".git" in dirs or ".git" in files:
+                add(root)
+            if root.count(os.sep) - depth >= max_depth:
+                dirs[:] = []
+            else:
+                dirs[:] = sorted(d for d in dirs if d not in SKIP_DIRS)
+
+    return repos
@@ -0,0 +1,112 @@
+"""
+A single long-lived background scheduler shared by every window.  Timers run on one
+thread, and the blocking network and subprocess calls are run on two bounded thread
+pools, so the number of threads does not grow with the number of windows or pending
+refreshes.
+
+asyncio is not available in the Python 3.3 plugin host of Sublime Text 3, hence the
+thread pools.
+"""
+
+import heapq
+import itertools
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Handle:
+    cancelled = False
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class EventLoop:
+
+    def __init__(self, workers=2, io_workers=4):
+        self.cond = threading.Condition()
+        self.queue = []
+        self.counter = itertools.count()
+        self.thread = None
+        self.closed = False
+        # `workers` run whole fetches, which wait for the requests they submit to `io`;
+        # keeping them apart makes sure that the waiting fetches cannot starve `io`
+        self.worker_count = workers
+        self.workers = ThreadPoolExecutor(max_workers=workers)
+        self.io_worker_count = io_workers
+        self.io = ThreadPoolExecutor(max_workers=io_workers)
+
+    def call_later(self, delay, callback):
+        """
+        Run `callback` on the loop thread after `delay` seconds.  The callback should
+        return quickly, e.g. by submitting the actual work to `workers`.
+        """
+        handle = Handle(callback)
+        with self.cond:
+            if self.closed:
+                handle.cancel()
+                return handle
+            heapq.heappush(self.queue, (time.time() + delay, next(self.counter), handle))
+            if not self.thread:
+                self.thread = threading.Thread(target=self._run, name="GitHubChecks")
+                self.thread.daemon = True
+                self.thread.start()
+            self.cond.notify()
+        return handle
+
+    def call_soon(self, callback):
+        return self.call_later(0, callback)
+
+    def run_in_worker(self, fn, *args, **kwargs):
+        return self.workers.submit(fn, *args, **kwargs)
+
+    def set_workers(self, workers, io_workers):
+        """
+        Resize the pools, e.g. after the concurrency setting was changed.
+        """
+        with self.cond:
+            if self.closed:
+                return
+            old = []
+            if workers != self.worker_count:
+                old.append(self.workers)
+                self.worker_count = workers
+                self.workers = ThreadPoolExecutor(max_workers=workers)
+            if io_workers != self.io_worker_count:
+                old.append(self.io)
+                self.io_worker_count = io_workers
+                self.io = ThreadPoolExecutor(max_workers=io_workers)
+        for executor in old:
+            executor.shutdown(wait=False)
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.closed:
+                    now = time.time()
+                    if self.queue and self.queue[0][0] <= now:
+                        _, _, handle = heapq.heappop(self.queue)
+                        break
+                    self.cond.wait(self.queue[0][0] - now if self.queue else None)
+                else:
+                    return
+
+            if handle.cancelled:
+                continue
+            try:
+                handle.callback()
+            except Exception:
+                traceback.print_exc()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.queue = []
+            self.cond.notify()
+        self.workers.shutdown(wait=False)
+        self.io.shutdown(wait=False)